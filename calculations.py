@@ -1,13 +1,11 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from shapely.geometry import shape, Polygon, MultiPolygon, Point
+from matplotlib.collections import PolyCollection
+from shapely.geometry import shape, Polygon, MultiPolygon
 import math
-from gis_service import fetch_srtm_elevation_data
+from terrain_engine import terrain_at_point, aspect_to_text
 from pyproj import Transformer
-import os
-import json
-from shapely.ops import transform
 
 
 # --- 🌐 KOORDİNAT DÖNÜŞÜM MOTORU ---
@@ -75,43 +73,15 @@ def smart_fix_coordinates(points):
 
 # --- 1. COĞRAFİ VE ALAN ANALİZİ ---
 def calculate_slope_aspect(lat, lon):
+    """
+    Nokta için (rakım m, eğim °, bakı yönü). Karo başına bir kez hesaplanan Horn rasterlarından okunur
+    (terrain_engine); hücre boyu enleme göre gerçek değerdir.
+    """
     try:
-        snap_lat, snap_lon = round(lat, 2), round(lon, 2)
-        pad = 0.005
-        bbox = [snap_lon - pad, snap_lat - pad, snap_lon + pad, snap_lat + pad]
-        data = fetch_srtm_elevation_data(bbox)
-
-        if data and data['success']:
-            Z, X, Y = data['z'], data['x'], data['y']
-            if Z is not None and Z.size > 0:
-                x_step, y_step = X[1] - X[0], Y[1] - Y[0]
-                col_f = (lon - X[0]) / x_step
-                row_f = (lat - Y[0]) / y_step
-                c0, r0 = int(np.floor(col_f)), int(np.floor(row_f))
-
-                if 0 <= r0 < Z.shape[0] - 1 and 0 <= c0 < Z.shape[1] - 1:
-                    tx, ty = col_f - c0, row_f - r0
-                    h00, h01 = Z[r0, c0], Z[r0, c0 + 1]
-                    h10, h11 = Z[r0 + 1, c0], Z[r0 + 1, c0 + 1]
-                    rakim = int(h00 * (1 - tx) * (1 - ty) + h01 * tx * (1 - ty) + h10 * (1 - tx) * ty + h11 * tx * ty)
-
-                    r, c = int(round(row_f)), int(round(col_f))
-                    if 0 < r < Z.shape[0] - 1 and 0 < c < Z.shape[1] - 1:
-                        a, b, c_val = Z[r - 1, c - 1], Z[r - 1, c], Z[r - 1, c + 1]
-                        d, e, f = Z[r, c - 1], Z[r, c], Z[r, c + 1]
-                        g, h, i = Z[r + 1, c - 1], Z[r + 1, c], Z[r + 1, c + 1]
-                        cell = 30.0
-                        dz_dx = ((c_val + 2 * f + i) - (a + 2 * d + g)) / (8.0 * cell)
-                        dz_dy = ((a + 2 * b + c_val) - (g + 2 * h + i)) / (8.0 * cell)
-                        slope_deg = math.degrees(math.atan(math.sqrt(dz_dx ** 2 + dz_dy ** 2)))
-                        aspect_rad = math.atan2(-dz_dy, -dz_dx)
-                        aspect_deg = math.degrees(aspect_rad)
-                        compass_deg = (90.0 - aspect_deg) % 360.0
-                        dirs = ["Kuzey", "Kuzeydoğu", "Doğu", "Güneydoğu", "Güney", "Güneybatı", "Batı", "Kuzeybatı"]
-                        baki_text = dirs[int((compass_deg + 22.5) / 45.0) % 8]
-                        return rakim, round(slope_deg, 1), baki_text
-                return int(Z[r0, c0]), 5.0, "Kuzey"
-        return 800, 5.0, "Güney"
+        terrain = terrain_at_point(lat, lon)
+        if terrain is None:
+            return 800, 5.0, "Güney"
+        return int(terrain["elevation"]), round(terrain["slope"], 1), aspect_to_text(terrain["aspect"])
     except:
         return 1000, 3.0, "Güney"
 
@@ -233,7 +203,22 @@ def generate_parsel_plot(geojson_data, layout_data=None):
                 plt.fill(gx, gy, alpha=0.3, fc='orange', ec='black', linewidth=2, label='Parsel')
 
         # 2. Panelleri Çiz (Varsa)
-        if layout_data and 'panels' in layout_data and layout_data['panels']:
+        from layout_engine import PanelTables
+
+        panels_raw = layout_data.get('panels') if layout_data else None
+        if isinstance(panels_raw, PanelTables) and len(panels_raw):
+            # Dizi tabanlı sonuç: Tüm masalar tek PolyCollection olarak çizilir
+            rings = panels_raw.rings()
+            px, py = panels_raw.centroids()[0]
+            near = abs(cx - px) < 0.1 and abs(cy - py) < 0.1
+            flipped = abs(cx - py) < 0.1 and abs(cy - px) < 0.1  # (Lat, Lon) vs (Lon, Lat)
+            if near or flipped:
+                ax.add_collection(PolyCollection(rings if near else rings[..., ::-1], facecolors='#2c3e50',
+                                                 edgecolors='none', alpha=0.9, label='Panel'))
+                ax.autoscale_view()
+            else:
+                print("Koordinat sistemi çok farklı, çizim atlanıyor.")
+        elif layout_data and 'panels' in layout_data and layout_data['panels']:
             panels_raw = layout_data['panels']
             # Veri Tipi Kontrolü (Liste ise Polygon'a çevir)
             panels_polys = []
@@ -290,42 +275,17 @@ def get_nearest_grid_distance(lat, lon):
     """
     Kullanıcı konumu ile en yakın TEİAŞ hattı/trafosu arasındaki en kısa mesafeyi hesaplar.
     Mühendislik hassasiyeti için WGS84'ten dinamik UTM metrik sistemine projeksiyon yapar.
+    Şebeke verisi süreç başına bir kez okunur; sorgular STRtree indeksi üzerinden yapılır.
     """
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        geojson_path = os.path.join(base_dir, "data", "sebeke_verisi.geojson")
+    from grid_index import get_grid_index
 
-        if not os.path.exists(geojson_path):
+    try:
+        grid_index = get_grid_index()
+        if grid_index is None:
             return None, "Şebeke verisi bulunamadı"
 
-        with open(geojson_path, 'r', encoding='utf-8') as f:
-            grid_data = json.load(f)
-
-        # Türkiye için dinamik UTM epsg kodunu bul (Örn: 32636) ve metre cinsine çevirici oluştur
-        utm_epsg = get_utm_zone_epsg(lon, "ITRF")
-        project_to_meters = Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True).transform
-
-        # Kullanıcının tıkladığı noktayı metreye çevir
-        user_point = Point(lon, lat)
-        user_point_m = transform(project_to_meters, user_point)
-
-        min_dist = float('inf')
-        nearest_name = "Bilinmeyen Hat/TM"
-
-        # Tüm şebeke verisini tara ve en yakını bul
-        for feature in grid_data.get('features', []):
-            if 'geometry' not in feature: continue
-
-            geom = shape(feature['geometry'])
-            geom_m = transform(project_to_meters, geom)
-            dist = user_point_m.distance(geom_m)
-
-            if dist < min_dist:
-                min_dist = dist
-                props = feature.get('properties', {})
-                nearest_name = props.get('name') or props.get('Name') or props.get('ad') or "İsimsiz Hat/TM"
-
-        if min_dist == float('inf'):
+        min_dist, nearest_name = grid_index.nearest(lat, lon)
+        if min_dist is None:
             return None, "Yakında şebeke bulunamadı"
 
         return min_dist, nearest_name
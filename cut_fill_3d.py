@@ -1,9 +1,14 @@
+import math
+import threading
+from collections import OrderedDict
+
 import numpy as np
+import shapely
 import geopandas as gpd
 import pandas as pd
 import plotly.graph_objects as go
-from scipy.interpolate import RegularGridInterpolator, griddata
-from shapely.geometry import Point, MultiPoint
+from scipy.interpolate import RegularGridInterpolator, LinearNDInterpolator, NearestNDInterpolator
+from shapely.geometry import MultiPoint
 import streamlit as st
 from pyproj import Transformer
 import json
@@ -94,26 +99,107 @@ def process_unified_file(uploaded_file):
 
 
 # --- 3. HİBRİT YÜKSEKLİK MODELİ ---
-def get_elevation_data(polygon, epsg_code, resolution=1.0, custom_points=None):
+MASK_CACHE_MB = 16  # Maske önbelleğinin süreç genelindeki bayt sınırı (tüm oturumlar için)
+SRTM_GRID_M = 10.0  # SRTM GL3 (~90 m) için hesap hücresi
+MIN_GRID_M = 0.5  # Ölçüm verisinde bile daha küçük hücre kullanılmaz
+GRID_MEMORY_BUDGET_MB = 64  # Izgara (Z + maske) için üst sınır
+GRID_BYTES_PER_CELL = 5  # float32 Z + bool maske
+GRID_TILE_CELLS = 250_000  # Enterpolasyon blok boyu (hücre)
+PLOT_MAX_SIDE = 200  # 3D yüzey çiziminde kenar başına en fazla hücre
+HEATMAP_MAX_SIDE = 60  # Kazı-dolgu ısı haritasında kenar başına en fazla karo
+
+
+# Aynı parselin farklı hedef kotlarla tekrar analizinde maske yeniden kullanılır.
+# Önbellek girdi sayısıyla değil toplam maske baytıyla sınırlıdır; tek başına sınırı aşan maske saklanmaz.
+_MASK_CACHE = OrderedDict()  # (parsel WKB, x0, y0, adım, nx, ny) -> salt okunur bool maske
+_MASK_CACHE_BYTES = 0
+_MASK_LOCK = threading.Lock()
+
+
+def _build_polygon_mask(polygon, x, y):
+    shapely.prepare(polygon)
+    mask = shapely.contains_xy(polygon, x[None, :], y[:, None])  # (ny, nx), yayınlama ile
+    mask.flags.writeable = False
+    return mask
+
+
+def polygon_mask(polygon, x, y, cache_mb=MASK_CACHE_MB):
+    """
+    Izgara hücrelerinin (x, y eksenleri) poligon içinde kalıp kalmadığı, vektörel contains_xy ile.
+    Sonuç (parsel, ızgara) başına, toplam cache_mb ile sınırlı LRU önbellekte tutulur;
+    salt okunur (len(y), len(x)) bool dizi döner.
+    """
+    global _MASK_CACHE_BYTES
+    step = float(x[1] - x[0]) if len(x) > 1 else 1.0
+    key = (polygon.wkb, float(x[0]), float(y[0]), step, len(x), len(y))
+    with _MASK_LOCK:
+        if key in _MASK_CACHE:
+            _MASK_CACHE.move_to_end(key)
+            return _MASK_CACHE[key]
+
+    mask = _build_polygon_mask(polygon, np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    limit = cache_mb * 1024 * 1024
+    if mask.nbytes <= limit:
+        with _MASK_LOCK:
+            if key not in _MASK_CACHE:
+                _MASK_CACHE[key] = mask
+                _MASK_CACHE_BYTES += mask.nbytes
+            while _MASK_CACHE_BYTES > limit:
+                _, evicted = _MASK_CACHE.popitem(last=False)
+                _MASK_CACHE_BYTES -= evicted.nbytes
+    return mask
+
+
+def plan_grid_resolution(polygon, custom_points=None, requested=None, memory_budget_mb=GRID_MEMORY_BUDGET_MB):
+    """
+    Hesap ızgarasının hücre boyu (m).
+    SRTM için SRTM_GRID_M (90 m veriden 1 m hücre bilgi katmaz); ölçüm noktalarında ortalama nokta aralığının
+    yarısı. Küçük parsellerde kenar başına ~10 hücre korunur. requested verilirse hücre ondan küçük olmaz.
+    Izgara bellek bütçesini aşacaksa hücre (her durumda) büyütülür.
+    """
+    minx, miny, maxx, maxy = polygon.bounds
+    width, height = max(maxx - minx, 1e-6), max(maxy - miny, 1e-6)
+    if requested:
+        res = float(requested)  # İstenen hücre boyu alt sınırdır (sadece bellek bütçesi büyütebilir)
+    else:
+        if custom_points:
+            res = math.sqrt(polygon.area / len(custom_points)) / 2.0
+        else:
+            res = SRTM_GRID_M
+        res = min(res, max(min(width, height) / 10.0, MIN_GRID_M))
+
+    max_cells = memory_budget_mb * 1024 ** 2 / GRID_BYTES_PER_CELL
+    res = max(res, math.sqrt(width * height / max_cells), MIN_GRID_M)
+    return math.ceil(res * 10.0 - 1e-9) / 10.0  # 0.1 m'ye yukarı yuvarla
+
+
+def get_elevation_data(polygon, epsg_code, resolution=None, custom_points=None):
+    """
+    Parsel için yükseklik ızgarası. Hücre boyu plan_grid_resolution ile seçilir (resolution verilirse alt sınırdır).
+    Sadece parsel içindeki hücreler, en fazla GRID_TILE_CELLS hücrelik satır blokları halinde enterpole edilir.
+    Dönüş: (x ekseni, y ekseni, Z float32 (len(y), len(x)), parsel dışı NaN) -- hücre merkezleri, metre
+    """
+    res = plan_grid_resolution(polygon, custom_points, resolution)
     minx, miny, maxx, maxy = polygon.bounds
-    x_fine = np.arange(minx, maxx, resolution)
-    y_fine = np.arange(miny, maxy, resolution)
-    X_target, Y_target = np.meshgrid(x_fine, y_fine)
-    Z = np.full(X_target.shape, np.nan)
+    nx, ny = max(int(math.ceil((maxx - minx) / res)), 1), max(int(math.ceil((maxy - miny) / res)), 1)
+    x_fine = minx + (np.arange(nx) + 0.5) * res
+    y_fine = miny + (np.arange(ny) + 0.5) * res
+    mask = polygon_mask(polygon, x_fine, y_fine)
+    Z = np.full((ny, nx), np.nan, dtype=np.float32)
 
-    # EĞER DOSYADA KOT VARSA -> MİLİMETRİK HESAP (Griddata Interpolasyonu)
+    # EĞER DOSYADA KOT VARSA -> MİLİMETRİK HESAP (Doğrusal enterpolasyon, dışarısı en yakın nokta)
     if custom_points is not None:
         st.toast("📌 Dosyadaki Z (Kot) verileri kullanılıyor.", icon="💎")
         pts_xy = np.array([(p[0], p[1]) for p in custom_points])
         pts_z = np.array([p[2] if p[2] is not None else 0 for p in custom_points])
+        linear, nearest = LinearNDInterpolator(pts_xy, pts_z), NearestNDInterpolator(pts_xy, pts_z)
 
-        Z_flat = griddata(pts_xy, pts_z, (X_target, Y_target), method='linear')
-        Z = Z_flat
-
-        # Sınır dışı boşlukları doldur
-        if np.isnan(Z).any():
-            Z_nearest = griddata(pts_xy, pts_z, (X_target, Y_target), method='nearest')
-            Z[np.isnan(Z)] = Z_nearest[np.isnan(Z)]
+        def sample(xs, ys):
+            z = linear(xs, ys)
+            gaps = np.isnan(z)
+            if gaps.any():
+                z[gaps] = nearest(xs[gaps], ys[gaps])
+            return z
 
     # EĞER KOT YOKSA -> UYDU VERİSİ (SRTM)
     else:
@@ -131,34 +217,88 @@ def get_elevation_data(polygon, epsg_code, resolution=1.0, custom_points=None):
 
             interp_func = RegularGridInterpolator((y_srtm, x_srtm), z_srtm, method='linear', bounds_error=False,
                                                   fill_value=None)
-            X_target_flat, Y_target_flat = X_target.ravel(), Y_target.ravel()
-            lon_target, lat_target = transformer_to_wgs84.transform(X_target_flat, Y_target_flat)
-            Z_flat = interp_func(np.array([lat_target, lon_target]).T)
-            Z = Z_flat.reshape(X_target.shape)
+
+            def sample(xs, ys):
+                lon_target, lat_target = transformer_to_wgs84.transform(xs, ys)
+                return interp_func(np.column_stack([lat_target, lon_target]))
         else:
             st.warning("⚠️ Arazi verisi çekilemedi, düz zemin varsayılıyor.")
-            Z = np.full(X_target.shape, 100.0)
 
-    # Poligon dışındaki kareleri sil (Sadece parsel içi kalsın)
-    for i in range(len(y_fine)):
-        for j in range(len(x_fine)):
-            if not polygon.contains(Point(x_fine[j], y_fine[i])):
-                Z[i, j] = np.nan
+            def sample(xs, ys):
+                return np.full(xs.shape, 100.0)
+
+    # Satır blokları: geçici diziler blok boyunda kalır; parsel dışı hücreler hiç hesaplanmaz
+    rows_per_tile = max(GRID_TILE_CELLS // nx, 1)
+    for r0 in range(0, ny, rows_per_tile):
+        rr, cc = np.nonzero(mask[r0:r0 + rows_per_tile])
+        if len(rr):
+            Z[r0 + rr, cc] = sample(x_fine[cc], y_fine[r0 + rr])
 
-    return X_target, Y_target, Z
+    return x_fine, y_fine, Z
 
 
 # --- 4. KAZI-DOLGU VE GÖRSELLEŞTİRME (AYNEN KORUNDU) ---
+def grid_cell_area(X, Y):
+    """Izgara eksenlerinden hücre alanı (m²)."""
+    if len(X) < 2 or len(Y) < 2:
+        return 1.0
+    return abs(float(X[1] - X[0])) * abs(float(Y[1] - Y[0]))
+
+
+def cut_fill_tiles(X, Y, Z, ideal_z=None, tile=None):
+    """
+    Kazı-dolgu hacimlerini ızgarayı karo satırları halinde dolaşarak tek geçişte toplar; tam boy geçici dizi
+    oluşmaz (en büyük geçici, bir karo satırıdır). ideal_z verilmezse ortalama kot önce aynı şekilde bulunur.
+    tile: Karo kenarı (hücre); verilmezse kenar başına en fazla HEATMAP_MAX_SIDE karo olacak şekilde seçilir.
+    Dönüş: (ideal_z, {"cut", "fill" (karo başına m³), "cells", "x", "y" (karo merkezleri, m), "tile_m"})
+    """
+    ny, nx = Z.shape
+    tile = tile or max(int(math.ceil(max(ny, nx) / HEATMAP_MAX_SIDE)), 1)
+    rows, cols = np.arange(0, ny, tile), np.arange(0, nx, tile)
+
+    if ideal_z is None:
+        total, count = 0.0, 0
+        for r0 in rows:
+            block = Z[r0:r0 + tile]
+            valid = ~np.isnan(block)
+            total += float(block.sum(where=valid, dtype=np.float64))
+            count += int(valid.sum())
+        ideal_z = total / count if count else float("nan")
+
+    cut = np.zeros((len(rows), len(cols)))
+    fill = np.zeros((len(rows), len(cols)))
+    cells = np.zeros((len(rows), len(cols)), dtype=np.int64)
+    for i, r0 in enumerate(rows):
+        diff = Z[r0:r0 + tile].astype(np.float64) - ideal_z
+        valid = ~np.isnan(diff)
+        diff[~valid] = 0.0
+        cut[i] = np.add.reduceat(np.maximum(diff, 0.0).sum(axis=0), cols)
+        fill[i] = np.add.reduceat(np.maximum(-diff, 0.0).sum(axis=0), cols)
+        cells[i] = np.add.reduceat(valid.sum(axis=0), cols)
+
+    cell_area = grid_cell_area(X, Y)
+    return ideal_z, {
+        "cut": cut * cell_area,
+        "fill": fill * cell_area,
+        "cells": cells,
+        "x": np.add.reduceat(X, cols) / np.diff(np.append(cols, nx)),
+        "y": np.add.reduceat(Y, rows) / np.diff(np.append(rows, ny)),
+        "tile_m": tile * math.sqrt(cell_area),
+    }
+
+
 def run_3d_analysis(X, Y, Z, unit_prices, target_z=None):
-    ideal_z = target_z if target_z is not None else np.nanmean(Z)
+    """Dönüş: (hedef kot, kazı m³, dolgu m³, maliyet, mod, karo dağılımı (cut_fill_tiles))"""
     mode = "Manuel Kot" if target_z is not None else "Otomatik Denge"
-    diff = Z - ideal_z
-    v_cut = np.nansum(np.where(diff > 0, diff, 0)) * 1.0
-    v_fill = np.nansum(np.where(diff < 0, np.abs(diff), 0)) * 1.0
-    return ideal_z, v_cut, v_fill, (v_cut * unit_prices['kazi']) + (v_fill * unit_prices['dolgu']), mode
+    ideal_z, tiles = cut_fill_tiles(X, Y, Z, target_z)
+    v_cut, v_fill = float(tiles["cut"].sum()), float(tiles["fill"].sum())
+    return ideal_z, v_cut, v_fill, (v_cut * unit_prices['kazi']) + (v_fill * unit_prices['dolgu']), mode, tiles
 
 
 def plot_3d(X, Y, Z, ideal_z, mode_label):
+    # Büyük ızgaralar tarayıcıya seyreltilerek gönderilir (kenar başına en fazla PLOT_MAX_SIDE hücre)
+    step = max(int(math.ceil(max(Z.shape) / PLOT_MAX_SIDE)), 1)
+    X, Y, Z = X[::step], Y[::step], Z[::step, ::step]
     fig = go.Figure()
 
     # 🎯 colorscale='Earth' yerine 'Jet' yazıldı.
@@ -176,6 +316,20 @@ def plot_3d(X, Y, Z, ideal_z, mode_label):
     return fig
 
 
+def plot_cut_fill_heatmap(tiles):
+    """Karo başına net hacim (kazı +, dolgu -) ısı haritası; parsel dışı karolar boş."""
+    net = np.where(tiles["cells"] > 0, tiles["cut"] - tiles["fill"], np.nan)
+    fig = go.Figure(go.Heatmap(z=net, x=tiles["x"], y=tiles["y"], colorscale='RdBu_r', zmid=0,
+                               colorbar=dict(title='m³'),
+                               customdata=np.dstack([tiles["cut"], tiles["fill"]]),
+                               hovertemplate='Kazı: %{customdata[0]:,.0f} m³<br>Dolgu: %{customdata[1]:,.0f} m³'
+                                             '<extra></extra>'))
+    fig.update_layout(title=f'Kazı (+) / Dolgu (-) Dağılımı - {tiles["tile_m"]:.0f} m karolar', height=500,
+                      xaxis_title='BATI ⟷ DOĞU (m)', yaxis_title='GÜNEY ⟷ KUZEY (m)',
+                      yaxis=dict(scaleanchor='x', scaleratio=1))
+    return fig
+
+
 # --- 5. ARAYÜZ (TEK UPLOADER) ---
 def show_3d_page():
     if st.button("⬅️ Analiz Sayfasına Dön", type="secondary"):
@@ -219,8 +373,9 @@ def show_3d_page():
                     with st.spinner("Arazi yüzeyi modelleniyor..."):
                         poly = metric_gdf.geometry.iloc[0]
                         X, Y, Z = get_elevation_data(poly, epsg_code, custom_points=custom_pts)
-                        ideal_z, cut, fill, cost, mode = run_3d_analysis(X, Y, Z, {'kazi': u_kazi, 'dolgu': u_dolgu},
-                                                                         target_z=manual_z_val)
+                        ideal_z, cut, fill, cost, mode, tiles = run_3d_analysis(X, Y, Z,
+                                                                                {'kazi': u_kazi, 'dolgu': u_dolgu},
+                                                                                target_z=manual_z_val)
 
                     st.divider()
                     k1, k2, k3, k4 = st.columns(4)
@@ -230,8 +385,10 @@ def show_3d_page():
                     k4.metric("💰 Toplam Maliyet", f"{cost:,.0f} TL")
 
                     st.plotly_chart(plot_3d(X, Y, Z, ideal_z, mode), use_container_width=True)
-                    data_source = "Ölçüm Dosyası (Z Verisi)" if custom_pts else "NASA SRTM GL3 (30m) - OpenTopography"
-                    st.caption(f"ℹ️ Veri Kaynağı: {data_source}")
+                    st.plotly_chart(plot_cut_fill_heatmap(tiles), use_container_width=True)
+                    data_source = "Ölçüm Dosyası (Z Verisi)" if custom_pts else "NASA SRTM GL3 (90m) - OpenTopography"
+                    grid_info = f"{grid_cell_area(X, Y) ** 0.5:.1f} m ({Z.shape[1]} x {Z.shape[0]})"
+                    st.caption(f"ℹ️ Veri Kaynağı: {data_source} | Hesap Izgarası: {grid_info}")
                 else:
                     st.error("🔒 Özellik Kilitli: Professional veya Ultra pakete geçiniz.")
         except Exception as e:
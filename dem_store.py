@@ -0,0 +1,271 @@
+import os
+import json
+import math
+import time
+import threading
+from concurrent.futures import Future
+import requests
+import numpy as np
+
+# --- YEREL DEM KARO DEPOSU (1° x 1° SRTM) ---
+# Her karo iki dosyadır: <AD>.npy (float32, kuzey üstte, NoData = NaN, mmap ile açılır) + <AD>.json (başlık)
+# Başlık: {"x0", "y0", "cellsize", "nrows", "ncols", "source"}; x0/y0 ilk sütun/satır HÜCRE MERKEZİDİR.
+# Yerel mod (çevrimdışı kurulumlar): Sadece diskteki karolar kullanılır; .npy yoksa aynı isimli .hgt okunur.
+
+DEM_TILE_DIR = os.environ.get("DEM_TILE_DIR",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "dem_tiles"))
+DEM_LOCAL_ONLY = os.environ.get("DEM_LOCAL_ONLY", "").lower() in ("1", "true", "yes")
+
+OPENTOPOGRAPHY_URL = "https://portal.opentopography.org/API/globaldem"
+DEM_TYPE = "SRTMGL3"
+TILE_TIMEOUT = 60  # 1° karo ~ 1200 x 1200 hücre
+TILE_FAILURE_TTL = 900  # Başarısız karo indirmesi bu süre (sn) tekrar denenmez (429 / zaman aşımı koruması)
+
+SNAP_DEG = 0.05  # İstek kutuları bu ızgaraya genişletilir (~5 km): yakın pencereler aynı anahtarı paylaşır
+
+_TILE_CACHE = {}  # karo adı -> açık karo (mmap)
+_TILE_LOCK = threading.Lock()
+_TILE_FAILURES = {}  # karo anahtarı -> son başarısız indirme zamanı (monotonic)
+
+_INFLIGHT = {}  # anahtar -> Future (süren indirme / okuma)
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def coalesce(key, build):
+    """
+    Aynı anahtar için eşzamanlı çağrıları tek işe indirger: ilk çağıran build()'i çalıştırır,
+    diğerleri aynı sonucu (veya hatayı) bekler. Sonuç saklanmaz; kalıcı önbellek çağıranın işidir.
+    """
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        owner = future is None
+        if owner:
+            future = _INFLIGHT[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        result = build()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
+
+
+def snap_bbox(south, west, north, east, step=SNAP_DEG):
+    """Kutuyu step ızgarasına dışa doğru yuvarlar. Dönüş: (south, west, north, east), kanonik anahtar"""
+    k = 1.0 / step
+    return (round(math.floor(south * k + 1e-9) / k, 6), round(math.floor(west * k + 1e-9) / k, 6),
+            round(math.ceil(north * k - 1e-9) / k, 6), round(math.ceil(east * k - 1e-9) / k, 6))
+
+
+def crop_window(data, south, west, north, east):
+    """
+    Kanonik pencereden istenen kutuyu keser (her yönde bir hücre taşarak; enterpolasyon / komşuluk için).
+    z ile aynı boyuttaki diğer rasterlar (eğim, bakı ...) da kesilir. Eksen başına en az 2 hücre bırakılır.
+    Dizi kopyalanmaz (görünüm döner).
+    """
+    x, y = data["x"], data["y"]
+    y_desc = y[0] > y[-1]
+    c0 = max(int(np.searchsorted(x, west, side="right")) - 2, 0)
+    c1 = min(int(np.searchsorted(x, east, side="left")) + 2, len(x))
+    ya = y[::-1] if y_desc else y
+    r0 = max(int(np.searchsorted(ya, south, side="right")) - 2, 0)
+    r1 = min(int(np.searchsorted(ya, north, side="left")) + 2, len(y))
+    if y_desc:
+        r0, r1 = len(y) - r1, len(y) - r0
+    window = dict(data, x=x[c0:c1], y=y[r0:r1])
+    for key, value in data.items():
+        if isinstance(value, np.ndarray) and value.shape == data["z"].shape:
+            window[key] = value[r0:r1, c0:c1]
+    return window
+
+
+def tile_name(lat, lon):
+    """Güneybatı köşesi (lat, lon) olan karonun SRTM adı: N39E032"""
+    return f"{'N' if lat >= 0 else 'S'}{abs(lat):02d}{'E' if lon >= 0 else 'W'}{abs(lon):03d}"
+
+
+def _parse_aaigrid(text):
+    """
+    ESRI ASCII Grid (AAIGrid) metnini ayrıştırır.
+    Başlık satırları bir kez okunur; gövde tek seferde (NumPy'ın C ayrıştırıcısı) float32 diziye çevrilir.
+    *llcenter başlıkları *llcorner'a çevrilir. NoData yerinde NaN yapılır.
+    Dönüş: (başlık sözlüğü, Z float32 dizisi)
+    """
+    header, pos = {}, 0
+    while pos < len(text):
+        end = text.find('\n', pos)
+        end = len(text) if end == -1 else end
+        parts = text[pos:end].split()
+        if parts and (len(parts) != 2 or parts[0][0].isdigit() or parts[0][0] in "+-."):
+            break  # Gövdenin ilk satırı
+        if parts:
+            header[parts[0].lower()] = float(parts[1])
+        pos = end + 1
+
+    ncols, nrows, cellsize = int(header['ncols']), int(header['nrows']), header['cellsize']
+    for axis in ("x", "y"):
+        if f"{axis}llcenter" in header and f"{axis}llcorner" not in header:
+            header[f"{axis}llcorner"] = header[f"{axis}llcenter"] - cellsize / 2.0
+
+    body = text[pos:]
+    try:
+        Z = np.loadtxt(body.splitlines(), dtype=np.float32, ndmin=2)
+    except ValueError:
+        Z = np.fromstring(body, dtype=np.float32, sep=' ')  # Satır uzunlukları düzensizse (satır kaydırmalı)
+    if Z.size != nrows * ncols:
+        raise ValueError(f"AAIGrid boyutu hatalı: {Z.size} != {nrows} x {ncols}")
+    Z = Z.reshape(nrows, ncols)
+    Z[Z == np.float32(header.get('nodata_value', -9999))] = np.nan
+    return header, Z
+
+
+def fetch_opentopography(south, west, north, east, api_key, timeout=15):
+    """
+    OpenTopography'den verilen kutunun AAIGrid yanıtını çeker. Dönüş: (başlık, Z) veya None
+    Aynı kutu için eşzamanlı istekler tek HTTP çağrısına indirgenir.
+    """
+    if not api_key:
+        return None
+    return coalesce(("opentopography", DEM_TYPE, south, west, north, east),
+                    lambda: _download_aaigrid(south, west, north, east, api_key, timeout))
+
+
+def _download_aaigrid(south, west, north, east, api_key, timeout):
+    params = {
+        "demtype": DEM_TYPE,
+        "south": south,
+        "north": north,
+        "west": west,
+        "east": east,
+        "outputFormat": "AAIGrid",
+        "API_Key": api_key
+    }
+    response = requests.get(OPENTOPOGRAPHY_URL, params=params, timeout=timeout)
+    if response.status_code != 200:
+        print(f"API Error: {response.status_code} - {response.text}")
+        return None
+    return _parse_aaigrid(response.text)
+
+
+def _write_tile(name, header, Z, tile_dir):
+    """Karoyu .npy + .json olarak atomik yazar (önce geçici dosya, sonra yerine taşıma)."""
+    os.makedirs(tile_dir, exist_ok=True)
+    nrows, ncols = Z.shape
+    cellsize = header['cellsize']
+    meta = {
+        "x0": header['xllcorner'] + cellsize / 2.0,
+        "y0": header['yllcorner'] + nrows * cellsize - cellsize / 2.0,
+        "cellsize": cellsize, "nrows": nrows, "ncols": ncols, "source": DEM_TYPE,
+    }
+    base = os.path.join(tile_dir, name)
+    with open(f"{base}.npy.tmp", "wb") as f:
+        np.save(f, Z.astype(np.float32), allow_pickle=False)
+    with open(f"{base}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(f"{base}.json.tmp", f"{base}.json")
+    os.replace(f"{base}.npy.tmp", f"{base}.npy")  # .npy en son: tamamlandı işareti
+
+
+def _open_tile(name, lat, lon, tile_dir):
+    """Diskteki karoyu açar: önce .npy + .json, yoksa .hgt (big-endian int16). Yoksa None."""
+    base = os.path.join(tile_dir, name)
+    if os.path.exists(f"{base}.npy") and os.path.exists(f"{base}.json"):
+        with open(f"{base}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return dict(meta, z=np.load(f"{base}.npy", mmap_mode='r', allow_pickle=False), nodata=None)
+
+    if os.path.exists(f"{base}.hgt"):
+        samples = int(round(math.sqrt(os.path.getsize(f"{base}.hgt") / 2)))  # 1201 (SRTM3) / 3601 (SRTM1)
+        z = np.memmap(f"{base}.hgt", dtype=">i2", mode="r", shape=(samples, samples))
+        return {"x0": float(lon), "y0": float(lat + 1), "cellsize": 1.0 / (samples - 1), "nrows": samples,
+                "ncols": samples, "source": "hgt", "z": z, "nodata": -32768}
+    return None
+
+
+def get_tile(lat, lon, api_key=None, tile_dir=DEM_TILE_DIR, local_only=DEM_LOCAL_ONLY):
+    """
+    (lat, lon) güneybatı köşeli 1° karoyu döndürür. Diskte yoksa (yerel mod kapalıysa) indirip kaydeder.
+    Başarısız indirmeler TILE_FAILURE_TTL boyunca hatırlanır; bu sürede None döner.
+    Dönüş: {"x0", "y0", "cellsize", "nrows", "ncols", "z", "nodata", ...} veya None
+    """
+    name = tile_name(lat, lon)
+    key = (tile_dir, name)
+    tile = _TILE_CACHE.get(key)
+    if tile is not None:
+        return tile
+    failed_at = _TILE_FAILURES.get(key)
+    if failed_at is not None and time.monotonic() - failed_at < TILE_FAILURE_TTL:
+        return None  # Yakın zamanda indirilemedi: her rerun'da API'yi tekrar beklemeyelim
+    return coalesce(("tile",) + key, lambda: _load_tile(name, key, lat, lon, api_key, tile_dir, local_only))
+
+
+def _load_tile(name, key, lat, lon, api_key, tile_dir, local_only):
+    """get_tile'ın önbellek dışı yolu: diskten aç, yoksa indirip yaz (karo başına tek eşzamanlı çağrı)."""
+    tile = _open_tile(name, lat, lon, tile_dir)
+    if tile is None and not local_only:
+        try:
+            result = fetch_opentopography(lat, lon, lat + 1, lon + 1, api_key, timeout=TILE_TIMEOUT)
+        except Exception:
+            _TILE_FAILURES[key] = time.monotonic()
+            raise
+        if result is None:
+            if api_key:  # Anahtar yoksa istek hiç yapılmadı; anahtar eklenince hemen denensin
+                _TILE_FAILURES[key] = time.monotonic()
+            return None
+        _TILE_FAILURES.pop(key, None)
+        header, Z = result
+        _write_tile(name, header, Z, tile_dir)
+        tile = _open_tile(name, lat, lon, tile_dir)
+    if tile is None:
+        return None
+
+    with _TILE_LOCK:
+        return _TILE_CACHE.setdefault(key, tile)
+
+
+def read_bbox(south, west, north, east, api_key=None, tile_dir=DEM_TILE_DIR, local_only=DEM_LOCAL_ONLY):
+    """
+    Rastgele bir kutuyu yerel karolardan keser (gerekirse eksik karolar indirilir).
+    Çıktı ızgarası karo çözünürlüğündedir ve karo sınırlarını aşabilir (mozaik).
+    Dönüş: {"x" (artan), "y" (azalan), "z" (NoData = NaN), "success": True} veya None
+    """
+    # Kutuya değen karolar (tam sayı kuzey/doğu sınırı bir sonraki karoyu gerektirmez)
+    lat_range = range(math.floor(south), max(math.ceil(north), math.floor(south) + 1))
+    lon_range = range(math.floor(west), max(math.ceil(east), math.floor(west) + 1))
+    tiles = {}
+    for lat in lat_range:
+        for lon in lon_range:
+            tile = get_tile(lat, lon, api_key=api_key, tile_dir=tile_dir, local_only=local_only)
+            if tile is None:
+                return None
+            tiles[(lat, lon)] = tile
+
+    cellsize = min(t["cellsize"] for t in tiles.values())
+    i0, i1 = math.ceil(west / cellsize - 1e-9), math.floor(east / cellsize + 1e-9)
+    j0, j1 = math.ceil(south / cellsize - 1e-9), math.floor(north / cellsize + 1e-9)
+    if i1 - i0 < 1: i0, i1 = i0 - 1, i1 + 1
+    if j1 - j0 < 1: j0, j1 = j0 - 1, j1 + 1
+    x = np.arange(i0, i1 + 1) * cellsize
+    y = np.arange(j1, j0 - 1, -1) * cellsize
+    Z = np.full((len(y), len(x)), np.nan, dtype=np.float32)
+
+    x_tile = np.clip(np.floor(x + 1e-9).astype(int), lon_range[0], lon_range[-1])
+    y_tile = np.clip(np.floor(y + 1e-9).astype(int), lat_range[0], lat_range[-1])
+    for (lat, lon), tile in tiles.items():
+        sel_x, sel_y = np.nonzero(x_tile == lon)[0], np.nonzero(y_tile == lat)[0]
+        if not len(sel_x) or not len(sel_y):
+            continue
+        cols = np.clip(np.rint((x[sel_x] - tile["x0"]) / tile["cellsize"]).astype(int), 0, tile["ncols"] - 1)
+        rows = np.clip(np.rint((tile["y0"] - y[sel_y]) / tile["cellsize"]).astype(int), 0, tile["nrows"] - 1)
+        block = np.asarray(tile["z"][rows[:, None], cols[None, :]], dtype=np.float32)
+        if tile["nodata"] is not None:
+            block[block == tile["nodata"]] = np.nan
+        Z[sel_y[:, None], sel_x[None, :]] = block
+
+    return {"x": x, "y": y, "z": Z, "success": True}
@@ -1,74 +1,252 @@
 import os
+import io
 import zipfile
-import re
 import json
+import xml.parsers.expat
+import numpy as np
 
+KML_CHUNK_SIZE = 64 * 1024  # KML akışından tek seferde okunan karakter sayısı
 
-def parse_grid_data_to_geojson(kmz_path):
-    features = []
+# İkili şebeke önbelleği (bellek eşlemeli .npy dizileri)
+GRID_CACHE_ARRAYS = ("coords", "kinds", "names", "offsets")  # offsets en son yazılır (tamamlandı işareti)
+KIND_POINT, KIND_LINE = 0, 1
+
+
+def _local_name(tag):
+    """'kml:Placemark' -> 'Placemark' (Ad alanı öneklerini atar)"""
+    return tag.rsplit(':', 1)[-1]
+
+
+def _placemark_to_feature(name, coord_text, precision=None):
+    """Tek bir Placemark'ın isim ve koordinat metninden GeoJSON Feature üretir."""
+    c_data = coord_text.strip().split()
+
+    def _num(v):
+        v = float(v)
+        return round(v, precision) if precision is not None else v
+
+    # NOKTA (Trafo)
+    if len(c_data) == 1:
+        parts = c_data[0].split(',')
+        if len(parts) >= 2:
+            return {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [_num(parts[0]), _num(parts[1])]},
+                "properties": {"name": name, "type": "Point", "mw": 0, "total": 100}
+            }
+
+    # HAT (LineString)
+    elif len(c_data) > 1:
+        path = []
+        for p in c_data:
+            parts = p.split(',')
+            if len(parts) >= 2:
+                path.append([_num(parts[0]), _num(parts[1])])
+        return {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": path},
+            "properties": {"name": name, "type": "Line", "kv": "154 kV"}
+        }
+    return None
+
+
+def iter_grid_features(kmz_path, precision=None):
+    """
+    KMZ içindeki KML'i zip'ten parça parça okur (olay tabanlı expat akışı).
+    Her Placemark kapandığı anda Feature olarak üretilir; dosyanın tamamı belleğe alınmaz.
+    Not: TEİAŞ KML'inde tanımsız 'xsi:' öneki olduğu için ad alanı işlemeyen expat kullanılır.
+    """
+    with zipfile.ZipFile(kmz_path, 'r') as z:
+        kml_files = [f for f in z.namelist() if f.lower().endswith('.kml')]
+        if not kml_files: return
+
+        ready = []
+        state = {"depth": 0, "name": None, "trafo": None, "coords": None, "capture": None, "buf": []}
+
+        def start(tag, attrs):
+            tag = _local_name(tag)
+            if tag == "Placemark":
+                state.update(depth=state["depth"] + 1, name=None, trafo=None, coords=None, capture=None)
+                return
+            if not state["depth"] or state["capture"]:
+                return
+            if tag == "name" and state["name"] is None:
+                state["capture"] = ("name", tag)
+            elif tag in ("SimpleData", "Data") and attrs.get("name") == "TRAFO_ADI" and state["trafo"] is None:
+                state["capture"] = ("trafo", tag)
+            elif tag == "coordinates" and state["coords"] is None:
+                state["capture"] = ("coords", tag)
+            if state["capture"]:
+                state["buf"] = []
+
+        def end(tag):
+            tag = _local_name(tag)
+            if not state["depth"]:
+                return
+            if tag == "Placemark":
+                state["depth"] -= 1
+                name = state["trafo"] or state["name"] or "İsimsiz"
+                if state["coords"]:
+                    feature = _placemark_to_feature(name, state["coords"], precision)
+                    if feature: ready.append(feature)
+                return
+            if state["capture"] and tag == state["capture"][1]:
+                key = state["capture"][0]
+                text = "".join(state["buf"])
+                state[key] = text if key == "coords" else text.strip()
+                state["capture"], state["buf"] = None, []
+
+        def chars(data):
+            if state["capture"]:
+                state["buf"].append(data)
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = chars
+
+        with z.open(kml_files[0]) as raw:
+            stream = io.TextIOWrapper(raw, encoding='utf-8', errors='ignore')
+            while True:
+                chunk = stream.read(KML_CHUNK_SIZE)
+                parser.Parse(chunk, not chunk)
+                yield from ready
+                ready.clear()
+                if not chunk: break
+
+
+def write_grid_geojson(kmz_path, output_path, compact=True, precision=None):
+    """
+    KMZ'yi akış halinde GeoJSON dosyasına yazar.
+    compact=True: Girintisiz, boşluksuz çıktı (indent=4'e göre çok daha küçük)
+    precision: Koordinat ondalık hanesi (6 hane ~ 0.1 m)
+    Dosya önce geçici isimle yazılır, bitince yerine taşınır (okuyucular yarım dosya görmez).
+    Dönüş: Yazılan feature sayısı
+    """
+    indent = None if compact else 4
+    separators = (',', ':') if compact else None
+    newline = "" if compact else "\n"
+    tmp_path = f"{output_path}.tmp"
+    count = 0
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write('{"type":"FeatureCollection","features":[' if compact else
+                '{\n    "type": "FeatureCollection",\n    "features": [')
+        for feature in iter_grid_features(kmz_path, precision=precision):
+            f.write(("," if count else "") + newline)
+            json.dump(feature, f, ensure_ascii=False, indent=indent, separators=separators)
+            count += 1
+        f.write(newline + "]}" + newline)
+
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def parse_grid_data_to_geojson(kmz_path, precision=None):
     if not os.path.exists(kmz_path):
         print(f"Hata: Dosya bulunamadı -> {kmz_path}")
         return None
 
     try:
-        raw_content = ""
-        with zipfile.ZipFile(kmz_path, 'r') as z:
-            kml_files = [f for f in z.namelist() if f.lower().endswith('.kml')]
-            if not kml_files: return None
-            with z.open(kml_files[0]) as f:
-                raw_content = f.read().decode('utf-8', errors='ignore')
-
-        pm_pattern = re.compile(r'<[\w:]*Placemark.*?>(.*?)</[\w:]*Placemark>', re.DOTALL)
-        placemarks = pm_pattern.findall(raw_content)
-
-        for pm_text in placemarks:
-            name = "İsimsiz"
-            # REGEX ile İsim bulma
-            trafo_match = re.search(r'name="TRAFO_ADI">([^<]+)<', pm_text)
-            if trafo_match:
-                name = trafo_match.group(1).strip()
-            else:
-                name_match = re.search(r'<[\w:]*name>(.*?)</[\w:]*name>', pm_text)
-                if name_match: name = name_match.group(1).strip()
-
-            # REGEX ile Koordinat bulma
-            coord_match = re.search(r'<[\w:]*coordinates>(.*?)</[\w:]*coordinates>', pm_text, re.DOTALL)
-            if coord_match:
-                c_data = coord_match.group(1).strip().split()
-
-                # NOKTA (Trafo)
-                if len(c_data) == 1:
-                    parts = c_data[0].split(',')
-                    if len(parts) >= 2:
-                        lon, lat = float(parts[0]), float(parts[1])
-                        features.append({
-                            "type": "Feature",
-                            "geometry": {"type": "Point", "coordinates": [lon, lat]},
-                            "properties": {"name": name, "type": "Point", "mw": 0, "total": 100}
-                        })
-
-                # HAT (LineString)
-                elif len(c_data) > 1:
-                    path = [[float(p.split(',')[0]), float(p.split(',')[1])] for p in c_data if len(p.split(',')) >= 2]
-                    features.append({
-                        "type": "Feature",
-                        "geometry": {"type": "LineString", "coordinates": path},
-                        "properties": {"name": name, "type": "Line", "kv": "154 kV"}
-                    })
-
-        return {"type": "FeatureCollection", "features": features}
-
+        return {"type": "FeatureCollection", "features": list(iter_grid_features(kmz_path, precision=precision))}
     except Exception as e:
         print(f"Dönüşüm Hatası: {e}")
         return None
 
 
+# --- İKİLİ ŞEBEKE ÖNBELLEĞİ ---
+def grid_cache_dir(geojson_path):
+    """data/sebeke_verisi.geojson -> data/sebeke_verisi_cache/"""
+    return os.path.splitext(geojson_path)[0] + "_cache"
+
+
+def build_grid_cache(source_path, cache_dir):
+    """
+    Şebeke verisini (KMZ veya GeoJSON) sıkıştırılmamış .npy dizilerine yazar:
+    coords (M, 2) float64 | offsets (F + 1) int64 | kinds (F) uint8 | names (F) unicode
+    Feature i'nin koordinatları: coords[offsets[i]:offsets[i + 1]]
+    Dönüş: Yazılan feature sayısı
+    """
+    if source_path.lower().endswith('.kmz'):
+        features = iter_grid_features(source_path)
+    else:
+        with open(source_path, 'r', encoding='utf-8') as f:
+            features = json.load(f).get('features', [])
+
+    coord_parts, offsets, kinds, names = [], [0], [], []
+    for feature in features:
+        geom = feature.get('geometry') or {}
+        if geom.get('type') == 'Point':
+            part, kind = np.asarray([geom['coordinates'][:2]], dtype=np.float64), KIND_POINT
+        elif geom.get('type') == 'LineString' and len(geom.get('coordinates', [])) >= 2:
+            part, kind = np.asarray([c[:2] for c in geom['coordinates']], dtype=np.float64), KIND_LINE
+        else:
+            continue
+        coord_parts.append(part)
+        offsets.append(offsets[-1] + len(part))
+        kinds.append(kind)
+        names.append(str(feature.get('properties', {}).get('name', "")))
+
+    arrays = {
+        "coords": np.concatenate(coord_parts) if coord_parts else np.empty((0, 2), dtype=np.float64),
+        "kinds": np.asarray(kinds, dtype=np.uint8),
+        "names": np.asarray(names, dtype=str),
+        "offsets": np.asarray(offsets, dtype=np.int64),
+    }
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for key in GRID_CACHE_ARRAYS:
+        path = os.path.join(cache_dir, f"{key}.npy")
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, arrays[key], allow_pickle=False)
+        os.replace(f"{path}.tmp", path)
+    return len(kinds)
+
+
+def grid_cache_mtime(cache_dir, source_path=None):
+    """Önbellek varsa ve kaynak dosyadan eski değilse önbelleğin mtime değeri, aksi halde None."""
+    marker = os.path.join(cache_dir, "offsets.npy")
+    if not os.path.exists(marker):
+        return None
+    mtime = os.path.getmtime(marker)
+    if source_path and os.path.exists(source_path) and os.path.getmtime(source_path) > mtime:
+        return None
+    return mtime
+
+
+def load_grid_cache(cache_dir, source_path=None):
+    """
+    İkili önbelleği bellek eşlemeli (mmap) olarak açar; JSON ayrıştırma yapılmaz.
+    source_path verilir ve önbellekten yeniyse (eskimiş önbellek) None döner.
+    Dönüş: {"coords", "offsets", "kinds", "names", "mtime"} veya None
+    """
+    mtime = grid_cache_mtime(cache_dir, source_path)
+    if mtime is None:
+        return None
+
+    try:
+        cache = {key: np.load(os.path.join(cache_dir, f"{key}.npy"), mmap_mode='r', allow_pickle=False)
+                 for key in GRID_CACHE_ARRAYS}
+    except (OSError, ValueError) as e:
+        print(f"Önbellek Okuma Hatası: {e}")
+        return None
+
+    if len(cache["offsets"]) != len(cache["kinds"]) + 1 or len(cache["names"]) != len(cache["kinds"]):
+        return None
+    cache["mtime"] = mtime
+    return cache
+
+
 if __name__ == "__main__":
     kmz_yolu = "data/trafo_merkez.kmz"
     cikti_yolu = "data/sebeke_verisi.geojson"
 
-    geojson_data = parse_grid_data_to_geojson(kmz_yolu)
-    if geojson_data:
-        with open(cikti_yolu, "w", encoding="utf-8") as f:
-            json.dump(geojson_data, f, ensure_ascii=False, indent=4)
-        print(f"✅ İşlem Tamam! {len(geojson_data['features'])} adet veri aktarıldı.")
\ No newline at end of file
+    if not os.path.exists(kmz_yolu):
+        print(f"Hata: Dosya bulunamadı -> {kmz_yolu}")
+    else:
+        adet = write_grid_geojson(kmz_yolu, cikti_yolu, compact=True, precision=6)
+        print(f"✅ İşlem Tamam! {adet} adet veri aktarıldı.")
+
+        # Çalışma zamanı için ikili önbellek (GeoJSON'dan üretilir, aynı hassasiyette)
+        adet = build_grid_cache(cikti_yolu, grid_cache_dir(cikti_yolu))
+        print(f"✅ İkili önbellek hazır: {grid_cache_dir(cikti_yolu)} ({adet} adet)")
@@ -48,6 +48,8 @@ import pandas as pd
 import numpy as np
 from shapely.geometry import Polygon, MultiPolygon
 import streamlit as st
+from geojson_output import grid_cache_dir, load_grid_cache, KIND_POINT
+from dem_store import read_bbox, fetch_opentopography, snap_bbox, crop_window, coalesce, DEM_LOCAL_ONLY
 
 # --- API AYARLARI (GÜVENLİ YÖNTEM) ---
 try:
@@ -125,73 +127,67 @@ def process_parsel_geojson(geojson_data):
         return None, None, None, False, str(e)
 
 
-# --- 2. GERÇEK SRTM VERİ ÇEKME (OPENTOPOGRAPHY & CACHING) ---
+# --- 2. GERÇEK SRTM VERİ ÇEKME (YEREL KARO DEPOSU + OPENTOPOGRAPHY) ---
 @st.cache_data(ttl=86400, show_spinner=False)  # 24 Saat Önbellek
-def fetch_srtm_elevation_data(bbox):
+def _fetch_srtm_window(south, west, north, east):
     """
-    OpenTopography API üzerinden gerçek SRTM GL3 (30m) verisini çeker.
-    Secrets'tan API Key okur.
+    Kanonik (snap_bbox ile hizalanmış) SRTM penceresi. Önbellek anahtarı sadece bu dört değerdir.
+    Önce yerel 1° karo deposundan keser (dem_store); eksik karolar bir kez indirilip diske yazılır.
+    Karo alınamazsa eski yöntemle sadece bu pencere OpenTopography'den çekilir.
     """
-    if not OPENTOPOGRAPHY_API_KEY:
-        print("UYARI: OpenTopography API Key bulunamadı (secrets.toml).")
-        return None
-
-    # BBOX'ı biraz genişletelim
-    pad = 0.002  # Yaklaşık 200m
-    south, north = bbox[1] - pad, bbox[3] + pad
-    west, east = bbox[0] - pad, bbox[2] + pad
-
-    url = "https://portal.opentopography.org/API/globaldem"
-    params = {
-        "demtype": "SRTMGL3",  # 30m Çözünürlük
-        "south": south,
-        "north": north,
-        "west": west,
-        "east": east,
-        "outputFormat": "AAIGrid",
-        "API_Key": OPENTOPOGRAPHY_API_KEY
-    }
-
     try:
-        response = requests.get(url, params=params, timeout=15)
+        data = read_bbox(south, west, north, east, api_key=OPENTOPOGRAPHY_API_KEY)
+        if data is not None:
+            return data
 
-        if response.status_code == 200:
-            content = response.text.splitlines()
-            header = {}
-            data_rows = []
-
-            for line in content:
-                parts = line.split()
-                if len(parts) == 2 and parts[0].lower() in ['ncols', 'nrows', 'xllcorner', 'yllcorner', 'cellsize',
-                                                            'nodata_value']:
-                    header[parts[0].lower()] = float(parts[1])
-                elif len(parts) > 2:
-                    data_rows.append([float(x) for x in parts])
-
-            Z = np.array(data_rows)
-            nodata = header.get('nodata_value', -9999)
-            Z[Z == nodata] = np.nan
+        if DEM_LOCAL_ONLY:
+            print("UYARI: Yerel DEM karosu bulunamadı (DEM_LOCAL_ONLY).")
+            return None
+        if not OPENTOPOGRAPHY_API_KEY:
+            print("UYARI: OpenTopography API Key bulunamadı (secrets.toml).")
+            return None
 
-            ncols = int(header['ncols'])
-            nrows = int(header['nrows'])
-            xll = header['xllcorner']
-            yll = header['yllcorner']
-            cellsize = header['cellsize']
+        result = fetch_opentopography(south, west, north, east, OPENTOPOGRAPHY_API_KEY)
+        if result is None:
+            return None
+        header, Z = result
 
-            x_coords = np.linspace(xll, xll + (ncols * cellsize), ncols)
-            y_coords = np.linspace(yll + (nrows * cellsize), yll, nrows)
+        ncols = int(header['ncols'])
+        nrows = int(header['nrows'])
+        xll = header['xllcorner']
+        yll = header['yllcorner']
+        cellsize = header['cellsize']
 
-            return {"x": x_coords, "y": y_coords, "z": Z, "success": True}
+        x_coords = np.linspace(xll, xll + (ncols * cellsize), ncols)
+        y_coords = np.linspace(yll + (nrows * cellsize), yll, nrows)
 
-        else:
-            print(f"API Error: {response.status_code} - {response.text}")
-            return None
+        return {"x": x_coords, "y": y_coords, "z": Z, "success": True}
 
     except Exception as e:
         print(f"SRTM Fetch Error: {e}")
         return None
 
 
+def fetch_srtm_elevation_data(bbox):
+    """
+    SRTM GL3 (90m) yükseklik verisi, bbox [min_lon, min_lat, max_lon, max_lat].
+    İstek kutusu kanonik ızgaraya (dem_store.SNAP_DEG) genişletilir; farklı dolgularla gelen yakın kutular
+    aynı pencereyi (ve önbellek kaydını) paylaşır, istenen alan bu pencereden kesilir.
+    Farklı oturumlardan aynı pencereye gelen eşzamanlı istekler tek okumaya/indirmeye indirgenir.
+    Secrets'tan API Key okur. DEM_LOCAL_ONLY=1 ile sadece diskteki karolar kullanılır.
+    """
+    # BBOX'ı biraz genişletelim
+    pad = 0.002  # Yaklaşık 200m
+    south, north = bbox[1] - pad, bbox[3] + pad
+    west, east = bbox[0] - pad, bbox[2] + pad
+
+    window = snap_bbox(south, west, north, east)
+    data = coalesce(("srtm_window",) + window, lambda: _fetch_srtm_window(*window))
+    if not data or not data.get('success') or data['z'] is None:
+        return data
+    return crop_window(data, south, west, north, east)
+
+
 def get_real_elevation_at_point(lat, lon):
     """
     Belirli bir nokta için yaklaşık rakım çeker.
@@ -206,26 +202,87 @@ def get_real_elevation_at_point(lat, lon):
 
 
 # --- 3. TEİAŞ TRAFO VERİSİ EŞLEŞTİRME ---
+TEIAS_CAPACITY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "teias_kapasite.json")
+
+
+class SubstationLookup:
+    """
+    teias_kapasite.json için önceden kurulmuş arama yapısı.
+    Tam eşleşme normalize isim sözlüğünden, bulanık eşleşme 3'lü n-gram indeksinden yapılır.
+    Sonuç, dosyayı baştan sona taramakla (ilk eşleşen kayıt) birebir aynıdır.
+    """
+    NGRAM = 3
+
+    def __init__(self, substations):
+        self.items = list(substations)
+        self.keys = [normalize_name_for_search(item.get("name", "")) for item in self.items]
+        self.exact = {}
+        self.ngrams = {}
+        for pos, key in enumerate(self.keys):
+            self.exact.setdefault(key, pos)
+            if len(key) > 3:
+                for gram in self._grams(key):
+                    self.ngrams.setdefault(gram, set()).add(pos)
+        self._memo = {}
+
+    @classmethod
+    def _grams(cls, key):
+        return {key[i:i + cls.NGRAM] for i in range(len(key) - cls.NGRAM + 1)}
+
+    def find(self, search_key):
+        if not search_key: return None
+        if search_key in self._memo: return self._memo[search_key]
+
+        hits = []
+        if search_key in self.exact:
+            hits.append(self.exact[search_key])
+
+        if len(search_key) > 3:
+            # Aranan isim, kayıt isminin içinde geçiyor mu? (n-gram kesişimi + doğrulama)
+            gram_sets = [self.ngrams.get(g) for g in self._grams(search_key)]
+            if gram_sets and all(gram_sets):
+                for pos in set.intersection(*gram_sets):
+                    if search_key in self.keys[pos]:
+                        hits.append(pos)
+
+            # Kayıt ismi, aranan ismin içinde geçiyor mu? (alt metinler sözlükte aranır)
+            for i in range(len(search_key)):
+                for j in range(i + 4, len(search_key) + 1):
+                    pos = self.exact.get(search_key[i:j])
+                    if pos is not None:
+                        hits.append(pos)
+
+        found = self.items[min(hits)] if hits else None
+        self._memo[search_key] = found
+        return found
+
+
+_SUBSTATION_CACHE = {}
+
+
+def get_substation_lookup(json_path=TEIAS_CAPACITY_PATH):
+    """Kapasite dosyasını bir kez yükler; dosya değişince (mtime) indeksi yeniler."""
+    if not os.path.exists(json_path): return None
+    mtime = os.path.getmtime(json_path)
+    cached = _SUBSTATION_CACHE.get(json_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(json_path, 'r', encoding='utf-8') as f:
+        db = json.load(f)
+    lookup = SubstationLookup(db.get("substations", []))
+    _SUBSTATION_CACHE[json_path] = (mtime, lookup)
+    return lookup
+
+
 def get_substation_data(tm_name):
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    json_path = os.path.join(base_dir, "data", "teias_kapasite.json")
     found_data = None
     search_key = normalize_name_for_search(tm_name)
 
-    if os.path.exists(json_path) and search_key:
+    if search_key:
         try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                db = json.load(f)
-            for item in db.get("substations", []):
-                db_name_raw = item.get("name", "")
-                db_key = normalize_name_for_search(db_name_raw)
-                if search_key == db_key:
-                    found_data = item
-                    break
-                if len(search_key) > 3 and len(db_key) > 3:
-                    if search_key in db_key or db_key in search_key:
-                        found_data = item
-                        break
+            lookup = get_substation_lookup()
+            if lookup:
+                found_data = lookup.find(search_key)
         except Exception as e:
             print(f"DB Error: {e}")
 
@@ -297,7 +354,26 @@ def get_pvgis_production(lat, lon, kwp=1, tilt=None, azimuth=0):
 
 
 # --- 6. ŞEBEKE PARSE ---
+def _grid_data_from_cache(cache):
+    """İkili önbellekten (geojson_output.build_grid_cache) harita listesi üretir; koordinatlar [lat, lon]."""
+    coords = np.asarray(cache['coords'])[:, ::-1]
+    offsets = cache['offsets']
+    grid_data = []
+    for i, kind in enumerate(cache['kinds'].tolist()):
+        segment = coords[offsets[i]:offsets[i + 1]]
+        name = str(cache['names'][i])
+        if kind == KIND_POINT:
+            grid_data.append({"type": "Point", "name": name or "Trafo", "coords": segment[0].tolist()})
+        else:
+            grid_data.append({"type": "Line", "name": name or "Hat", "path": segment.tolist()})
+    return grid_data
+
+
 def parse_grid_data(geojson_path):
+    cache = load_grid_cache(grid_cache_dir(geojson_path), source_path=geojson_path)
+    if cache is not None:
+        return _grid_data_from_cache(cache)
+
     grid_data = []
     try:
         with open(geojson_path, 'r', encoding='utf-8') as f:
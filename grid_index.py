@@ -0,0 +1,234 @@
+import os
+import json
+import threading
+import numpy as np
+import shapely
+from shapely.geometry import shape, Point
+from shapely.strtree import STRtree
+from scipy.spatial import cKDTree
+from pyproj import Transformer
+
+from calculations import get_utm_zone_epsg
+from gis_service import get_substation_data, TEIAS_CAPACITY_PATH
+from geojson_output import grid_cache_dir, grid_cache_mtime, load_grid_cache, KIND_POINT
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GRID_GEOJSON_PATH = os.path.join(BASE_DIR, "data", "sebeke_verisi.geojson")
+
+
+# --- YARDIMCI: ÖZELLİK İSMİ ---
+def _feature_name(props):
+    return props.get('name') or props.get('Name') or props.get('ad') or "İsimsiz Hat/TM"
+
+
+# --- 1. ŞEBEKE MEKANSAL İNDEKSİ ---
+class GridNetworkIndex:
+    def __init__(self, geoms, names, kinds):
+        """
+        geoms: WGS84 (lon, lat) shapely geometrileri
+        names: Her geometrinin hat/trafo ismi
+        kinds: "Point" veya "Line"
+        UTM projeksiyonu ve STRtree, sorgulanan her dilim için bir kez kurulur.
+        """
+        self.geoms = np.asarray(geoms, dtype=object)
+        self.names = list(names)
+        self.kinds = np.asarray(kinds)
+        self.substation_ids = np.flatnonzero(self.kinds == "Point")
+        self._zones = {}
+        self._capacity_cache = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_geojson(cls, grid_data):
+        geoms, names, kinds = [], [], []
+        for feature in grid_data.get('features', []):
+            if 'geometry' not in feature: continue
+            geom = shape(feature['geometry'])
+            if geom.is_empty: continue
+            geoms.append(geom)
+            names.append(_feature_name(feature.get('properties', {})))
+            kinds.append("Point" if geom.geom_type == "Point" else "Line")
+        return cls(geoms, names, kinds)
+
+    @classmethod
+    def from_cache(cls, cache):
+        """İkili önbellekteki (geojson_output.build_grid_cache) dizilerden geometrileri toplu kurar."""
+        coords, offsets, kinds = cache["coords"], cache["offsets"], cache["kinds"]
+        geoms = np.empty(len(kinds), dtype=object)
+        is_point = kinds == KIND_POINT
+        geoms[is_point] = shapely.points(coords[offsets[:-1][is_point]])
+
+        line_ids = np.flatnonzero(~is_point)
+        if line_ids.size:
+            counts = np.diff(offsets)[line_ids]
+            starts = offsets[:-1][line_ids]
+            shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            vertex_ids = np.arange(counts.sum()) + shift
+            geoms[line_ids] = shapely.linestrings(coords[vertex_ids],
+                                                  indices=np.repeat(np.arange(line_ids.size), counts))
+
+        names = [str(n) or "İsimsiz Hat/TM" for n in cache["names"]]
+        return cls(geoms, names, np.where(is_point, "Point", "Line"))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _zone(self, utm_epsg):
+        """Geometrileri verilen UTM dilimine TEK SEFERDE (vektörel) projekte eder ve STRtree kurar."""
+        zone = self._zones.get(utm_epsg)
+        if zone is not None:
+            return zone
+        with self._lock:
+            zone = self._zones.get(utm_epsg)
+            if zone is None:
+                transformer = Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True)
+
+                def _project(xy):
+                    mx, my = transformer.transform(xy[:, 0], xy[:, 1])
+                    return np.column_stack([mx, my])
+
+                geoms_m = shapely.transform(self.geoms, _project)
+                zone = {"transformer": transformer, "geoms": geoms_m, "tree": STRtree(geoms_m),
+                        "sub_xy": shapely.get_coordinates(geoms_m[self.substation_ids]), "sub_tree": None}
+                self._zones[utm_epsg] = zone
+        return zone
+
+    def nearest(self, lat, lon):
+        """
+        Noktaya en yakın hat/trafoyu logaritmik zamanda bulur.
+        Dönüş: (mesafe_metre, isim) veya hiç veri yoksa (None, None)
+        """
+        if not len(self):
+            return None, None
+        zone = self._zone(get_utm_zone_epsg(lon, "ITRF"))
+        mx, my = zone["transformer"].transform(lon, lat)
+        idx, dist = zone["tree"].query_nearest(Point(mx, my), return_distance=True)
+        if len(dist) == 0:
+            return None, None
+        return float(dist[0]), self.names[int(idx[0])]
+
+    def _capacity(self):
+        """
+        Trafo noktalarını TEİAŞ kapasite verisiyle (get_substation_data) eşleştirir.
+        Eşleştirme kapasite dosyası değişmediği sürece bir kez yapılır.
+        """
+        mtime = os.path.getmtime(TEIAS_CAPACITY_PATH) if os.path.exists(TEIAS_CAPACITY_PATH) else None
+        cached = self._capacity_cache
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        records = [get_substation_data(self.names[i]) for i in self.substation_ids]
+        capacity = {
+            "free_mw": np.array([r["free_mw"] for r in records], dtype=float),
+            "total_mw": np.array([r["total_mw"] for r in records], dtype=float),
+            "voltage": [r["voltage"] for r in records],
+            "status": [r["status"] for r in records],
+        }
+        self._capacity_cache = (mtime, capacity)
+        return capacity
+
+    def nearest_substations(self, points, k=1, min_free_mw=None, max_distance_m=None):
+        """
+        N adet nokta için en yakın k trafo merkezini tek çağrıda bulur.
+        points: (lat, lon) çiftlerinden oluşan (N, 2) dizi
+        min_free_mw: Sadece boş kapasitesi bu değere eşit/büyük trafolar (Örn: 10 MW)
+        max_distance_m: Bu mesafeden uzak trafolar sonuca eklenmez
+        Dönüş: N elemanlı liste; her eleman mesafeye göre sıralı trafo sözlükleri listesi
+        """
+        pts = np.atleast_2d(np.asarray(points, dtype=float))
+        results = [[] for _ in range(len(pts))]
+        if len(pts) == 0 or len(self.substation_ids) == 0 or k < 1:
+            return results
+
+        capacity = self._capacity()
+        candidates = np.arange(len(self.substation_ids))
+        if min_free_mw is not None:
+            candidates = np.flatnonzero(capacity["free_mw"] >= min_free_mw)
+        if candidates.size == 0:
+            return results
+        k_eff = min(k, candidates.size)
+        upper = max_distance_m if max_distance_m is not None else np.inf
+
+        lat, lon = pts[:, 0], pts[:, 1]
+        zone_codes = np.array([get_utm_zone_epsg(x, "ITRF") for x in lon])
+
+        for utm_epsg in np.unique(zone_codes):
+            sel = np.flatnonzero(zone_codes == utm_epsg)
+            zone = self._zone(str(utm_epsg))
+
+            # Filtresiz sorgular için KD-ağacı dilim başına bir kez kurulur
+            if candidates.size == len(self.substation_ids):
+                if zone["sub_tree"] is None:
+                    zone["sub_tree"] = cKDTree(zone["sub_xy"])
+                tree = zone["sub_tree"]
+            else:
+                tree = cKDTree(zone["sub_xy"][candidates])
+
+            mx, my = zone["transformer"].transform(lon[sel], lat[sel])
+            dist, pos = tree.query(np.column_stack([mx, my]), k=k_eff, distance_upper_bound=upper)
+            dist, pos = dist.reshape(len(sel), k_eff), pos.reshape(len(sel), k_eff)
+
+            for row, point_id in enumerate(sel):
+                for d, p in zip(dist[row], pos[row]):
+                    if not np.isfinite(d): continue
+                    sub = candidates[p]
+                    geom = self.geoms[self.substation_ids[sub]]
+                    results[point_id].append({
+                        "name": self.names[self.substation_ids[sub]],
+                        "distance_m": float(d),
+                        "free_mw": float(capacity["free_mw"][sub]),
+                        "total_mw": float(capacity["total_mw"][sub]),
+                        "voltage": capacity["voltage"][sub],
+                        "status": capacity["status"][sub],
+                        "lat": geom.y, "lon": geom.x
+                    })
+        return results
+
+
+# --- 2. SÜREÇ İÇİ ÖNBELLEK (DOSYA DEĞİŞİNCE YENİLENİR) ---
+_INDEX_CACHE = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def get_grid_index(geojson_path=GRID_GEOJSON_PATH):
+    """
+    Şebeke indeksini süreç başına bir kez kurar.
+    Güncel bir ikili önbellek (*_cache/) varsa GeoJSON yerine o bellek eşlemeli olarak açılır.
+    Kaynağın değiştirilme zamanı (mtime) değişirse indeks yeniden oluşturulur.
+    """
+    cache_dir = grid_cache_dir(geojson_path)
+    with _INDEX_LOCK:
+        cache_mtime = grid_cache_mtime(cache_dir, source_path=geojson_path)
+        if cache_mtime is not None:
+            key = ("cache", cache_mtime)
+        elif os.path.exists(geojson_path):
+            key = ("geojson", os.path.getmtime(geojson_path))
+        else:
+            return None
+
+        cached = _INDEX_CACHE.get(geojson_path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        cache = load_grid_cache(cache_dir, source_path=geojson_path) if cache_mtime is not None else None
+        if cache is not None:
+            index = GridNetworkIndex.from_cache(cache)
+        elif os.path.exists(geojson_path):
+            key = ("geojson", os.path.getmtime(geojson_path))
+            with open(geojson_path, 'r', encoding='utf-8') as f:
+                index = GridNetworkIndex.from_geojson(json.load(f))
+        else:
+            return None
+        _INDEX_CACHE[geojson_path] = (key, index)
+        return index
+
+
+def find_nearest_substations(points, k=1, min_free_mw=None, max_distance_m=None):
+    """
+    Toplu aday parsel taraması için kısayol.
+    Örn: find_nearest_substations(parseller, k=3, min_free_mw=10)
+    """
+    grid_index = get_grid_index()
+    if grid_index is None:
+        return [[] for _ in range(len(np.atleast_2d(points)))]
+    return grid_index.nearest_substations(points, k=k, min_free_mw=min_free_mw, max_distance_m=max_distance_m)
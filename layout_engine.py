@@ -1,88 +1,450 @@
-from shapely.geometry import Polygon, Point
+import os
+import hashlib
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from shapely.geometry import shape
+from shapely import affinity
+import shapely
 import numpy as np
+import pandas as pd
+from pyproj import Transformer
+
+from calculations import get_utm_zone_epsg
+from terrain_engine import table_terrain_mask
+
+
+def _grid_starts(start, stop, step, size):
+    """
+    start'tan step adımlarla ilerleyen ve start + size < stop koşulunu sağlayan başlangıç noktaları.
+    Eski while döngüsüyle (current += step) birebir aynı değerleri üretir.
+    """
+    if step <= 0 or start + size >= stop:
+        return np.empty(0)
+    n = int(np.ceil((stop - start) / step)) + 2
+    values = np.cumsum(np.concatenate([[start], np.full(n - 1, step)]))
+    return values[values + size < stop]
+
+
+PLACEMENT_PHASES = 4  # Ortalanmış faza ek olarak adımın 1/4'ü kadar kaydırılarak denenen ızgara fazı sayısı
+PLACEMENT_EPSILON = 0.01  # m; sınıra tam oturan masalar elenmesin diye içerme testi bu kadar içeriden yapılır
+
+
+def _grid_phases(start, stop, step, size, phases=PLACEMENT_PHASES):
+    """
+    Aynı eksen için aday başlangıç dizileri (_grid_starts). İlki artan boşluğu iki uca eşit dağıtır (ortalanmış),
+    diğerleri adımın k/phases kesri kadar kaydırılmıştır. Sınır (bounds) köşesine yapışık ızgara, UTM'de eksene
+    tam paralel olmayan kenarlarda ilk sırayı kaybettiği için kullanılmaz.
+    """
+    span = stop - start - size
+    if step <= 0 or span < 0:
+        return []
+    slack = span - np.floor(span / step) * step
+    offsets = [slack / 2.0] + [step * k / phases for k in range(phases)]
+    stop = stop + 2 * PLACEMENT_EPSILON
+    return [_grid_starts(start + offset, stop, step, size) for offset in offsets]
+
+
+def _rotate_xy(xy, angle_deg, origin):
+    """(..., 2) koordinatları origin etrafında angle_deg (saat yönü tersi) döndürür."""
+    a = np.radians(angle_deg)
+    c, s = np.cos(a), np.sin(a)
+    dx, dy = xy[..., 0] - origin[0], xy[..., 1] - origin[1]
+    return np.stack([origin[0] + dx * c - dy * s, origin[1] + dx * s + dy * c], axis=-1)
+
+
+LAYOUT_CACHE_SIZE = 32  # Motor başına saklanan güvenli bölge / yerleşim sonucu sayısı
+
+
+def _cached(cache, key, build):
+    """Küçük LRU önbellek: key varsa sonucu döndürür, yoksa build() ile üretip ekler (en eskiyi atar)."""
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = cache[key] = build()
+    if len(cache) > LAYOUT_CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+def table_size(panel_width, panel_height, table_rows, table_cols, col_spacing=0.5):
+    """Masa (sehpa) ölçüleri, m: (genişlik, derinlik). Derinlikte paneller arası 2 cm boşluk bırakılır."""
+    table_width = (panel_width * table_cols) + (col_spacing * (table_cols - 1 if table_cols > 1 else 0))
+    table_depth = (panel_height * table_rows) + (0.02 * (table_rows - 1))
+    return table_width, table_depth
+
+
+# Sehpa tipleri: Arayüz etiketi -> (satır, sütun)
+TABLE_TYPES = {
+    "2x20 (40 Panel)": (2, 20),
+    "2x10 (20 Panel)": (2, 10),
+    "2x5 (10 Panel)": (2, 5),
+    "1x5 (5 Panel)": (1, 5),
+}
+
+
+class PanelTables:
+    """
+    Yerleşim sonucu masalar: (N, 4, 2) köşe dizisi (lon, lat) + masa başına meta veri dizileri.
+    row: Parça içindeki sıra numarası | part: Parça numarası (1'den başlar)
+    Eski liste formatıyla uyumludur: len(), bool() ve iterasyon kapalı halka [(lon, lat) x 5] listeleri üretir.
+    """
+    __slots__ = ("corners", "row", "part")
+
+    def __init__(self, corners, row=None, part=None):
+        self.corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+        n = len(self.corners)
+        self.row = np.zeros(n, dtype=np.int32) if row is None else np.asarray(row, dtype=np.int32)
+        self.part = np.ones(n, dtype=np.int32) if part is None else np.asarray(part, dtype=np.int32)
+
+    @classmethod
+    def from_rings(cls, rings):
+        """Eski format [[(lon, lat) x 5], ...] listesinden; sıralar ilk köşenin enlemine göre numaralanır."""
+        corners = np.asarray([list(r)[:4] for r in rings], dtype=np.float64).reshape(-1, 4, 2)
+        _, row = np.unique(np.round(corners[:, 0, 1], 9), return_inverse=True)
+        return cls(corners, row=row)
+
+    def __len__(self):
+        return len(self.corners)
+
+    def __iter__(self):
+        for ring in self.rings().tolist():
+            yield [tuple(c) for c in ring]
+
+    def __getitem__(self, i):
+        return [tuple(c) for c in self.rings()[i].tolist()]
+
+    def rings(self, precision=None):
+        """(N, 5, 2) kapalı halkalar (matplotlib PolyCollection ve GeoJSON için doğrudan kullanılabilir)."""
+        rings = np.concatenate([self.corners, self.corners[:, :1]], axis=1)
+        return np.round(rings, precision) if precision is not None else rings
+
+    def centroids(self):
+        return self.corners.mean(axis=1)
+
+    def to_polygons(self):
+        """Shapely Polygon dizisi (vektörel, tek çağrı)."""
+        return shapely.polygons(self.rings())
+
+    def to_geojson_features(self, properties=None, precision=None):
+        """Masa başına bir Polygon feature."""
+        properties = properties or {}
+        return [{"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]}, "properties": properties}
+                for ring in self.rings(precision).tolist()]
+
+    def digest(self):
+        """İçeriğin kısa özeti (harita parmak izi vb. için, JSON serileştirme yapmadan)."""
+        h = hashlib.md5(self.corners.tobytes())
+        h.update(self.row.tobytes())
+        h.update(self.part.tobytes())
+        return h.hexdigest()
+
+
+def as_panel_tables(panels):
+    """PanelTables veya eski liste formatını PanelTables'a çevirir (None/boş -> boş PanelTables)."""
+    if isinstance(panels, PanelTables):
+        return panels
+    return PanelTables.from_rings(panels or [])
+
+
+def _place_tables(safe_zone, table_width, table_depth, x_step, y_step):
+    """
+    Tek bir güvenli bölgeye (metre, masa eksenlerinde) masaları vektörel olarak yerleştirir.
+    Izgara fazı _grid_phases adaylarından en çok masa sığdıranı seçilir.
+    Önce 4 köşe (intersects_xy), sonra kalan adaylar için tam içerme (contains) test edilir.
+    Dönüş: (halkalar (N, 5, 2), satır indeksleri (N,), taranan satır sayısı)
+    """
+    rings, rows = np.empty((0, 5, 2)), np.empty(0, dtype=np.intp)
+    if safe_zone.is_empty:
+        return rings, rows, 0
+
+    minx, miny, maxx, maxy = safe_zone.bounds
+    y_options = _grid_phases(miny, maxy, y_step, table_depth)
+    x_options = _grid_phases(minx, maxx, x_step, table_width)
+    if not (x_options and y_options):
+        return rings, rows, 0
+
+    shapely.prepare(safe_zone)
+    eps = PLACEMENT_EPSILON
+
+    def corner_fits(xs, ys):
+        x0, y0 = np.meshgrid(xs, ys)  # (satır, sütun)
+        x1, y1 = x0 + table_width, y0 + table_depth
+        fits = (shapely.intersects_xy(safe_zone, x0 + eps, y0 + eps) &
+                shapely.intersects_xy(safe_zone, x1 - eps, y0 + eps) &
+                shapely.intersects_xy(safe_zone, x1 - eps, y1 - eps) &
+                shapely.intersects_xy(safe_zone, x0 + eps, y1 - eps))
+        return x0, y0, x1, y1, fits
+
+    # Faz seçimi: Önce sıra (y) fazı ortalanmış sütunlarla, sonra sütun (x) fazı seçilen sıralarla.
+    # Puan, ucuz köşe testini geçen aday sayısıdır; eşitlikte ortalanmış faz kalır.
+    ys = max(y_options, key=lambda cand: int(np.count_nonzero(corner_fits(x_options[0], cand)[4])))
+    xs = max(x_options, key=lambda cand: int(np.count_nonzero(corner_fits(cand, ys)[4])))
+    if not (len(xs) and len(ys)):
+        return rings, rows, len(ys)
+
+    # Köşe testi (gerekli koşul) -> tam içerme testi (yeterli koşul, epsilon kadar içe çekilmiş masa ile)
+    x0, y0, x1, y1, fits = corner_fits(xs, ys)
+    rows, cols = np.nonzero(fits)
+    if rows.size:
+        # Halka sırası: p1, p2, p3, p4, p1
+        cx0, cx1 = x0[rows, cols], x1[rows, cols]
+        cy0, cy1 = y0[rows, cols], y1[rows, cols]
+        rings = np.stack([np.column_stack([cx0, cy0]), np.column_stack([cx1, cy0]),
+                          np.column_stack([cx1, cy1]), np.column_stack([cx0, cy1]),
+                          np.column_stack([cx0, cy0])], axis=1)
+        inset = rings + np.array([[eps, eps], [-eps, eps], [-eps, -eps], [eps, -eps], [eps, eps]])
+        inside = shapely.contains(safe_zone, shapely.polygons(inset))
+        rings, rows = rings[inside], rows[inside]
+    return rings, rows, len(ys)
+
+
+def _repair_part(part):
+    """
+    Tek lotu doğrular; geçersizse make_valid ile onarır (sadece alan bileşenleri tutulur).
+    Dönüş: (geometri, {"status": "geçerli" / "onarıldı" / "geçersiz" / "boş", "note": geçersizlik nedeni})
+    """
+    if part.is_empty:
+        return part, {"status": "boş", "note": ""}
+    if part.is_valid:
+        return part, {"status": "geçerli", "note": ""}
+
+    reason = shapely.is_valid_reason(part)
+    polys = [g for g in shapely.get_parts(shapely.make_valid(part)) if g.geom_type in ("Polygon", "MultiPolygon")]
+    fixed = shapely.union_all(polys) if polys else shapely.Polygon()
+    if fixed.is_empty or fixed.area <= 0:
+        return shapely.Polygon(), {"status": "geçersiz", "note": reason}
+    return fixed, {"status": "onarıldı", "note": reason}
 
 
 class SolarLayoutEngine:
-    def __init__(self, geometry_geojson):
+    def __init__(self, geometry_geojson, exclusions=None):
         """
-        geometry_geojson: GeoJSON formatındaki Polygon geometrisi
+        geometry_geojson: GeoJSON formatındaki Polygon / MultiPolygon geometrisi (tüm parçalar ve delikler korunur)
+        exclusions: Yerleşim dışı alanlar (kuyu, direk vb.), GeoJSON geometri sözlükleri veya shapely geometrileri
+                    (WGS84). Çekme payı kadar genişletilerek parselden çıkarılır.
         """
-        coords = geometry_geojson.get("coordinates", [])
-
-        if geometry_geojson["type"] == "Polygon":
-            self.polygon = Polygon(coords[0])
-        elif geometry_geojson["type"] == "MultiPolygon":
-            polys = [Polygon(p[0]) for p in coords]
-            self.polygon = max(polys, key=lambda a: a.area)
+        if geometry_geojson.get("type") in ("Polygon", "MultiPolygon") and geometry_geojson.get("coordinates"):
+            self.polygon = shape(geometry_geojson)
         else:
             self.polygon = None
 
-    def generate_layout(self, panel_width, panel_height, setback, row_spacing, col_spacing, table_rows, table_cols):
-        """
-        Sadeleştirilmiş Yerleşim Motoru + Verimlilik Analizi
-        """
-        if not self.polygon or not self.polygon.is_valid:
-            return {"panels": [], "capacity_kw": 0, "count": 0, "area_m2": 0, "skipped_rows": 0}
+        # Ara sonuç önbellekleri: Sadece değişen parametreye bağlı adımlar yeniden hesaplanır
+        # _zones: (setback, azimuth) -> hazırlanmış güvenli bölgeler
+        # _placements: (setback, azimuth, masa ölçüleri, adımlar) -> parça bazlı yerleşim dizileri
+        self._exclusion_buffers, self._zones, self._placements = OrderedDict(), OrderedDict(), OrderedDict()
 
-        # 1. ÇEKME PAYI (Setback)
-        buffer_deg = -setback * 0.000009
-        safe_zone = self.polygon.buffer(buffer_deg)
+        # Parsel TEK SEFER UTM dilimine projekte edilir; yerleşim metre cinsinden yapılır
+        self.polygon_m, self.parts_m, self.part_status, self.exclusions_m = None, [], [], None
+        if self.polygon is not None and not self.polygon.is_empty:
+            self.utm_epsg = get_utm_zone_epsg(self.polygon.centroid.x)
+            self._to_utm = Transformer.from_crs("EPSG:4326", f"EPSG:{self.utm_epsg}", always_xy=True)
+            self._to_wgs = Transformer.from_crs(f"EPSG:{self.utm_epsg}", "EPSG:4326", always_xy=True)
+            # Lotlar tek tek doğrulanır: Ortak kenarlı komşu lotlar geçersiz bir MultiPolygon oluşturur
+            # (normal kadastro durumu), bu yüzden bütün yerine her parça ayrı onarılıp yerleştirilir.
+            repaired = [_repair_part(part) for part in
+                        shapely.get_parts(shapely.transform(self.polygon, self._project_to_utm))]
+            self.parts_m = [part for part, _ in repaired]
+            self.part_status = [status for _, status in repaired]
+            usable = [part for part in self.parts_m if not part.is_empty]
+            self.polygon_m = shapely.union_all(usable) if usable else None
 
-        if safe_zone.is_empty:
-            return {"panels": [], "capacity_kw": 0, "count": 0, "area_m2": 0, "skipped_rows": 0}
+            if exclusions:
+                geoms = [g if isinstance(g, shapely.Geometry) else shape(g) for g in exclusions]
+                self.exclusions_m = shapely.transform(shapely.union_all(geoms), self._project_to_utm)
 
-        # 2. SINIR KUTUSU
-        minx, miny, maxx, maxy = safe_zone.bounds
+    def _project_to_utm(self, xy):
+        x, y = self._to_utm.transform(xy[:, 0], xy[:, 1])
+        return np.column_stack([x, y])
 
-        # 3. MASA BOYUTLARI
-        table_width = (panel_width * table_cols) + (col_spacing * (table_cols - 1 if table_cols > 1 else 0))
-        table_depth = (panel_height * table_rows) + (0.02 * (table_rows - 1))
+    def _project_to_wgs(self, xy):
+        lon, lat = self._to_wgs.transform(xy[:, 0], xy[:, 1])
+        return np.column_stack([lon, lat])
 
-        # 4. IZGARA OLUŞTURMA (GRID)
-        panels = []
-        panel_count = 0
+    def _safe_zone(self, part, setback, azimuth, pivot):
+        """Parçanın çekme paylı, yasak alanları çıkarılmış ve masa eksenlerine döndürülmüş güvenli bölgesi."""
+        zone = part.buffer(-setback)
+        if self.exclusions_m is not None and not zone.is_empty:
+            excluded = _cached(self._exclusion_buffers, setback, lambda: self.exclusions_m.buffer(setback))
+            zone = zone.difference(excluded)
+        if azimuth and not zone.is_empty:
+            zone = affinity.rotate(zone, azimuth, origin=pivot)
+        shapely.prepare(zone)
+        return zone
 
-        y_step = (table_depth + row_spacing) * 0.000009
-        x_step = (table_width + col_spacing) * 0.000011
+    def _safe_zones(self, setback, azimuth, pivot):
+        """Tüm parçaların güvenli bölgeleri; (setback, azimuth) değişmedikçe önbellekten gelir."""
+        return _cached(self._zones, (setback, azimuth),
+                       lambda: [self._safe_zone(part, setback, azimuth, pivot) for part in self.parts_m])
+
+    def generate_layout(self, panel_width, panel_height, setback, row_spacing, col_spacing, table_rows, table_cols,
+                        azimuth=0.0, terrain=None, max_slope=None, exclude_north=False):
+        """
+        Sadeleştirilmiş Yerleşim Motoru + Verimlilik Analizi
+        Yerleşim parselin UTM projeksiyonunda (metre) yapılır; derece-metre katsayıları kullanılmaz.
+        MultiPolygon parçaları (lotlar) eşzamanlı yerleştirilir; delikler ve yasak alanlar dışarıda kalır.
+        Geçersiz lotlar tek tek onarılır; her parçanın durumu (geçerli / onarıldı / geçersiz / boş) "parts"ta döner.
+        Seçilen masaların köşeleri tek bir vektörel dönüşümle WGS84'e geri projekte edilir.
+        azimuth: Masa dizilerinin güneyden sapma açısı (°), + batıya / - doğuya döndürür.
+        terrain: terrain_engine.get_terrain_raster çıktısı; max_slope (°) üzerindeki veya (exclude_north)
+                 kuzeye bakan hücrelere düşen masalar tek bir vektörel raster sorgusuyla elenir.
+        """
+        if self.polygon_m is None or self.polygon_m.is_empty:
+            parts = [dict(status, part=i + 1, area_m2=0.0, tables=0, count=0, capacity_kw=0.0, skipped_rows=0,
+                          terrain_excluded=0) for i, status in enumerate(self.part_status)]
+            return {"panels": PanelTables(np.empty((0, 4, 2))), "capacity_kw": 0, "count": 0, "area_m2": 0,
+                    "kiosk": [], "skipped_rows": 0, "azimuth": azimuth, "parts": parts, "terrain_excluded": 0}
 
-        # --- YENİ EKLENEN: SATIR ANALİZİ ---
-        total_rows_scanned = 0
-        filled_rows = 0
+        # 1. MASA BOYUTLARI VE IZGARA ADIMLARI (metre)
+        table_width, table_depth = table_size(panel_width, panel_height, table_rows, table_cols, col_spacing)
+        y_step = table_depth + row_spacing
+        x_step = table_width + col_spacing
 
-        current_y = miny
-        while current_y + (table_depth * 0.000009) < maxy:
-            total_rows_scanned += 1
-            row_has_panel = False  # Bu satıra hiç panel koyduk mu?
+        # 2. ÇEKME PAYI + YASAK ALANLAR: Her parça için ayrı güvenli bölge (ortak döndürme merkezi)
+        pivot = (self.polygon_m.centroid.x, self.polygon_m.centroid.y)
+        zones = self._safe_zones(setback, azimuth, pivot)
 
-            current_x = minx
-            while current_x + (table_width * 0.000011) < maxx:
-                p1 = (current_x, current_y)
-                p2 = (current_x + x_step - (col_spacing * 0.000011), current_y)
-                p3 = (current_x + x_step - (col_spacing * 0.000011), current_y + (table_depth * 0.000009))
-                p4 = (current_x, current_y + (table_depth * 0.000009))
+        # 3. YERLEŞİM: Parçalar iş parçacıklarında (shapely 2 vektörel işlemlerde GIL'i bırakır)
+        def _place(zone):
+            return _place_tables(zone, table_width, table_depth, x_step, y_step)
 
-                table_poly = Polygon([p1, p2, p3, p4])
+        def _place_all():
+            if len(zones) > 1:
+                with ThreadPoolExecutor(max_workers=min(len(zones), os.cpu_count() or 1)) as pool:
+                    return list(pool.map(_place, zones))
+            return [_place(zone) for zone in zones]
 
-                if safe_zone.contains(table_poly):
-                    panels.append(list(table_poly.exterior.coords))
-                    panel_count += (table_rows * table_cols)
-                    row_has_panel = True  # Evet, bu satıra panel koyduk
+        placed = _cached(self._placements, (setback, azimuth, table_width, table_depth, x_step, y_step), _place_all)
 
-                current_x += x_step
+        # 4. GERİ PROJEKSİYON: (N, 4, 2) metre -> (N, 4, 2) lon/lat, tek çağrı
+        corners = np.concatenate([r[:, :4] for r, _, _ in placed]) if placed else np.empty((0, 4, 2))
+        if len(corners):
+            if azimuth:
+                corners = _rotate_xy(corners, -azimuth, pivot)
+            corners = self._project_to_wgs(corners.reshape(-1, 2)).reshape(corners.shape)
+        row_ids = np.concatenate([rows for _, rows, _ in placed]) if placed else np.empty(0, dtype=np.intp)
+        part_ids = np.repeat(np.arange(1, len(placed) + 1), [len(rows) for _, rows, _ in placed])
 
-            if row_has_panel:
-                filled_rows += 1
+        # 5. ARAZİ FİLTRESİ: Dik / kuzeye bakan hücrelerdeki masalar (vektörel raster sorgusu)
+        keep = np.ones(len(corners), dtype=bool)
+        if terrain is not None and (max_slope is not None or exclude_north):
+            keep = table_terrain_mask(terrain, corners, max_slope=max_slope, exclude_north=exclude_north)
+        panels = PanelTables(corners[keep], row=row_ids[keep], part=part_ids[keep])
 
-            current_y += y_step
+        # 6. Parça bazlı istatistik
+        parts, skipped_rows = [], 0
+        for i, (_, _, scanned) in enumerate(placed):
+            in_part = part_ids == i + 1
+            part_tables = int(np.count_nonzero(keep & in_part))
+            part_count = part_tables * (table_rows * table_cols)
+            part_skipped = scanned - len(np.unique(row_ids[keep & in_part]))
+            skipped_rows += part_skipped
+            parts.append({"part": i + 1, "area_m2": self.parts_m[i].area, "tables": part_tables,
+                          "count": part_count, "capacity_kw": round(part_count * 0.550, 2),
+                          "skipped_rows": part_skipped,
+                          "terrain_excluded": int(np.count_nonzero(~keep & in_part)),
+                          **self.part_status[i]})
 
+        panel_count = len(panels) * (table_rows * table_cols)
         capacity = round(panel_count * 0.550, 2)
-        skipped_rows = total_rows_scanned - filled_rows
 
         return {
             "panels": panels,
             "capacity_kw": capacity,
             "count": panel_count,
-            "area_m2": self.polygon.area * 100000000,
+            "area_m2": self.polygon_m.area,
             "kiosk": [],
-            "skipped_rows": skipped_rows  # Yeni Veri
-        }
\ No newline at end of file
+            "skipped_rows": skipped_rows,  # Yeni Veri
+            "azimuth": azimuth,
+            "parts": parts,
+            "terrain_excluded": int(np.count_nonzero(~keep))
+        }
+
+    def candidate_azimuths(self, max_deviation=30.0):
+        """
+        Parselin minimum döndürülmüş dikdörtgeni (rotating calipers) kenar yönlerinden aday azimutlar.
+        Güneyden ±max_deviation dışında kalan yönler aday olmaz; 0° (tam güney) her zaman adaydır.
+        Açılar yuvarlanmaz: Yuvarlanmış açı döndürülmüş güvenli bölgeyi eksenden kaydırır (sadece gösterimde yuvarlayın).
+        """
+        candidates = {0.0}
+        if self.polygon_m is None:
+            return sorted(candidates)
+
+        corners = shapely.get_coordinates(shapely.minimum_rotated_rectangle(self.polygon_m))
+        if len(corners) >= 3:
+            edges = np.diff(corners[:3], axis=0)  # Dikdörtgenin iki dik kenarı
+            edge_deg = np.degrees(np.arctan2(edges[:, 1], edges[:, 0]))
+            # Sıra yönü kenara paralel olacak azimut: azimuth = -kenar açısı, (-90, 90] aralığına indirgenir
+            azimuths = (90 - edge_deg) % 180 - 90
+            for a in azimuths:
+                if abs(a) <= max_deviation and all(abs(a - c) > 1e-6 for c in candidates):
+                    candidates.add(float(a))
+        return sorted(candidates)
+
+    def optimize_azimuth(self, panel_width, panel_height, setback, row_spacing, col_spacing, table_rows, table_cols,
+                         max_deviation=30.0, azimuths=None, **layout_kwargs):
+        """
+        Aday yönlerin her biri için (vektörel) yerleşim yapar, en çok paneli sığdıranı döndürür.
+        Eşitlikte güneye daha yakın yön seçilir. Sonuca tüm adayların özeti 'azimuth_scan' olarak eklenir.
+        layout_kwargs: generate_layout'a aynen iletilir (terrain, max_slope, exclude_north)
+        """
+        if azimuths is None:
+            azimuths = self.candidate_azimuths(max_deviation)
+
+        best, scan = None, []
+        for azimuth in azimuths:
+            res = self.generate_layout(panel_width, panel_height, setback, row_spacing, col_spacing,
+                                       table_rows, table_cols, azimuth=azimuth, **layout_kwargs)
+            scan.append({"azimuth": azimuth, "capacity_kw": res["capacity_kw"], "count": res["count"]})
+            if best is None or (res["count"], -abs(azimuth)) > (best["count"], -abs(best["azimuth"])):
+                best = res
+
+        best["azimuth_scan"] = scan
+        return best
+
+
+# --- PARAMETRE TARAMASI (SWEEP) ---
+def _sweep_chunk(geometry_geojson, exclusions, panel_width, panel_height, col_spacing, layout_kwargs, combos):
+    """Süreç havuzu işçisi: Motoru bir kez kurar, kendisine düşen kombinasyonları sırayla çalıştırır."""
+    engine = SolarLayoutEngine(geometry_geojson, exclusions=exclusions)
+    rows = []
+    for row_spacing, setback, table_type, azimuth in combos:
+        t_r, t_c = TABLE_TYPES[table_type]
+        res = engine.generate_layout(panel_width, panel_height, setback=setback, row_spacing=row_spacing,
+                                     col_spacing=col_spacing, table_rows=t_r, table_cols=t_c, azimuth=azimuth,
+                                     **layout_kwargs)
+        rows.append({
+            "table_type": table_type, "row_spacing": row_spacing, "setback": setback, "azimuth": azimuth,
+            "capacity_kw": res["capacity_kw"], "count": res["count"], "tables": len(res["panels"]),
+            "skipped_rows": res["skipped_rows"],
+        })
+    return rows
+
+
+def sweep_layouts(geometry_geojson, panel_width, panel_height, row_spacings, setbacks, table_types,
+                  azimuths=(0.0,), col_spacing=0.5, max_workers=None, exclusions=None, **layout_kwargs):
+    """
+    (dizi mesafesi, çekme payı, sehpa tipi, azimut) kombinasyonlarının tamamını süreç havuzunda çalıştırır.
+    table_types: TABLE_TYPES anahtarları ("2x20 (40 Panel)" ...)
+    layout_kwargs: Her çalıştırmada generate_layout'a iletilir (terrain, max_slope, exclude_north)
+    Dönüş: Kapasiteye göre sıralanmış DataFrame (eşitlikte daha az boş sıra, sonra daha geniş dizi mesafesi)
+    """
+    combos = list(itertools.product(row_spacings, setbacks, table_types, azimuths))
+    columns = ["table_type", "row_spacing", "setback", "azimuth", "capacity_kw", "count", "tables", "skipped_rows"]
+    if not combos:
+        return pd.DataFrame(columns=columns)
+
+    workers = min(max_workers or os.cpu_count() or 1, len(combos))
+    chunks = [combos[i::workers] for i in range(workers)]
+    args = (geometry_geojson, exclusions, panel_width, panel_height, col_spacing, layout_kwargs)
+
+    if workers == 1:
+        results = [_sweep_chunk(*args, chunks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = [f.result() for f in [pool.submit(_sweep_chunk, *args, c) for c in chunks]]
+
+    df = pd.DataFrame([r for chunk in results for r in chunk], columns=columns)
+    df = df.sort_values(["capacity_kw", "skipped_rows", "row_spacing"], ascending=[False, True, False])
+    df.index = pd.RangeIndex(1, len(df) + 1, name="rank")
+    return df
@@ -3,6 +3,8 @@ import streamlit as st
 import pandas as pd
 import json
 import time
+import math
+import hashlib
 from datetime import datetime
 from streamlit_folium import st_folium
 import folium
@@ -17,7 +19,9 @@ from ui_utils import (hide_header_footer, render_google_login,
 from auth_ui import show_auth_pages
 from ai_service import generate_smart_report_summary
 from gis_service import process_parsel_geojson, get_basemaps, fetch_pvgis_horizon, get_pvgis_production
-from map_manager import create_base_map, add_teias_layer, add_parsel_layer, add_panel_layer
+from map_manager import (create_base_map, add_teias_layer, add_parsel_layer, add_panel_layer, get_view_bounds,
+                         get_map_fingerprint, prepare_teias_layer, prepare_panel_layer, panel_detail_level,
+                         needs_zoom_tracking, snap_view_bounds)
 from calculations import (
     calculate_slope_aspect, get_solar_potential, transform_points, get_utm_zone_epsg,
     calculate_geodesic_area, calculate_bankability_metrics, generate_horizon_plot,
@@ -27,7 +31,9 @@ from calculations import (
 )
 from equipment_db import PANEL_LIBRARY, INVERTER_LIBRARY
 from ges_engine import perform_string_analysis
-from layout_engine import SolarLayoutEngine
+from layout_engine import SolarLayoutEngine, TABLE_TYPES, sweep_layouts, table_size
+from shading_engine import minimum_row_pitch, pitch_tradeoff, slope_toward_south
+from terrain_engine import get_terrain_raster, parcel_terrain_stats, USABLE_SLOPE, PERCENTILES
 from reports import generate_full_report
 from profile_page import show_profile_page
 from user_config import ROLE_PERMISSIONS, has_permission
@@ -110,7 +116,8 @@ if 'initialized' not in st.session_state:
         'username': "Misafir", 'parsel_geojson': None, 'parsel_location': None,
         'layout_data': None, 'report_package': None, 'analysis_results': {}, 'string_results': None,
         'map_initialized': False, 'horizon_data': None, 'pvgis_yield_data': None, 'panel_tilt': 30,
-        'last_processed_file': None, 'map_updater': False
+        'last_processed_file': None, 'map_updater': False, 'sweep_results': None,
+        'row_spacing_suggest': 3.5, 'pitch_tradeoff': None
     }
     for k, v in defaults.items():
         if k not in st.session_state: st.session_state[k] = v
@@ -140,6 +147,19 @@ def update_from_map(clicked_lat, clicked_lon):
     st.session_state.map_updater = True
 
 
+def get_layout_engine(geometry, exclusions=None):
+    """
+    Parsel ve yasak alanlar değişmedikçe aynı yerleşim motoru oturumda saklanır.
+    Böylece projekte parsel, güvenli bölgeler ve aday ızgaralar tıklamalar arasında yeniden kullanılır.
+    """
+    key = hashlib.md5(json.dumps([geometry, exclusions], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    cached = st.session_state.get("layout_engine")
+    if not cached or cached[0] != key:
+        cached = (key, SolarLayoutEngine(geometry, exclusions=exclusions))
+        st.session_state.layout_engine = cached
+    return cached[1]
+
+
 # --------------------------------------------------------------------------
 # GLOBAL SIDEBAR
 # --------------------------------------------------------------------------
@@ -376,27 +396,83 @@ else:
     with col1:
         basemaps = get_basemaps();
         secim = st.radio("Görünüm", list(basemaps.keys()), horizontal=True, label_visibility="collapsed")
-        m = create_base_map(st.session_state.lat, st.session_state.lon, basemaps[secim],
-                            auto_locate=(not st.session_state.map_initialized) and (
-                                        st.session_state.parsel_geojson is None))
-        st.session_state.map_initialized = True
+        auto_locate = (not st.session_state.map_initialized) and (st.session_state.parsel_geojson is None)
 
         has_grid_perm = has_permission(st.session_state.user_role, "tm_proximity")
         toggle_label = "⚡ Şebekeyi Göster" if has_grid_perm else "⚡ Şebekeyi Göster (🔒 Ultra Paket)"
-
-        if st.toggle(toggle_label, disabled=not has_grid_perm):
-            add_teias_layer(m)
-
+        show_grid = st.toggle(toggle_label, disabled=not has_grid_perm)
+
+        # 🎯 Ağır katman verileri (şebeke, paneller) sadece görünümü etkileyen durum değişince yeniden hazırlanır.
+        # folium.Map her render'da eleman eklediği için objenin kendisi saklanmaz; harita her rerun'da bu
+        # hazır verilerden yeniden kurulur (ucuz).
+        # Seçili konum değişince harita görünümü (zoom, merkez, şebeke kutusu) sıfırlanır
+        view_anchor = (st.session_state.lat, st.session_state.lon)
+        if st.session_state.get('map_view_anchor') != view_anchor:
+            st.session_state.map_view_anchor = view_anchor
+            st.session_state.map_zoom = st.session_state.map_center = st.session_state.map_bounds = None
+        # Zoom sadece büyük yerleşimlerde (detay eşiği için) ve şebeke açıkken (görünümü korumak için) takip edilir;
+        # aksi halde zoom/kaydırma rerun tetiklemez
+        track_zoom = needs_zoom_tracking(st.session_state.layout_data)
+        map_zoom = st.session_state.get('map_zoom') if track_zoom or show_grid else None
+        panel_zoom = map_zoom if track_zoom else None
+        # Şebeke haritanın gerçek görünümüne göre çizilir; görünüm henüz bilinmiyorsa (ilk render) merkez kutusu
+        grid_bounds = None
+        if show_grid:
+            grid_bounds = st.session_state.get('map_bounds') or get_view_bounds(st.session_state.lat,
+                                                                                st.session_state.lon)
+        map_key = get_map_fingerprint(st.session_state.lat, st.session_state.lon, secim, show_grid,
+                                      st.session_state.parsel_geojson, st.session_state.layout_data,
+                                      st.session_state.selected_panel_brand, st.session_state.selected_panel_model,
+                                      st.session_state.analysis_results, auto_locate,
+                                      zoom=panel_zoom, view_bounds=grid_bounds)
+        cached_layers = st.session_state.get('map_layers')
+        if not cached_layers or cached_layers[0] != map_key:
+            cached_layers = (map_key, {
+                "teias": prepare_teias_layer(grid_bounds) if show_grid else None,
+                "panels": prepare_panel_layer(st.session_state.layout_data, st.session_state.selected_panel_brand,
+                                              st.session_state.selected_panel_model,
+                                              zoom=panel_zoom),
+            })
+            st.session_state.map_layers = cached_layers
+        layers = cached_layers[1]
+
+        m = create_base_map(st.session_state.lat, st.session_state.lon, basemaps[secim], auto_locate=auto_locate)
+        if layers["teias"]:
+            add_teias_layer(m, prepared=layers["teias"])
         add_parsel_layer(m, st.session_state.parsel_geojson, st.session_state.analysis_results,
                          st.session_state.layout_data)
-        add_panel_layer(m, st.session_state.layout_data, st.session_state.selected_panel_brand,
-                        st.session_state.selected_panel_model)
+        if layers["panels"]:
+            add_panel_layer(m, st.session_state.layout_data, st.session_state.selected_panel_brand,
+                            st.session_state.selected_panel_model, prepared=layers["panels"])
+        st.session_state.map_initialized = True
 
-        out = st_folium(m, height=550, width="100%", returned_objects=["last_clicked"], key="main_map")
+        returned = ["last_clicked"] + (["zoom"] if track_zoom or show_grid else [])
+        if show_grid:
+            returned += ["center", "bounds"]
+        # Katmanlar değişip harita yeniden kurulunca son görünüm (merkez/zoom) korunur
+        out = st_folium(m, height=550, width="100%", returned_objects=returned, zoom=map_zoom,
+                        center=st.session_state.get('map_center') if show_grid else None, key="main_map")
         if out and out['last_clicked']:
             if abs(out['last_clicked']['lat'] - st.session_state.lat) > 0.0001:
                 update_from_map(out['last_clicked']['lat'], out['last_clicked']['lng']);
                 st.rerun()
+        if out:
+            view_changed = False
+            new_zoom = out.get('zoom')
+            if new_zoom is not None and new_zoom != map_zoom and (track_zoom or show_grid):
+                # Zoom panel detay eşiğini geçerse büyük yerleşimler masa masa (veya tekrar sıra blokları) çizilir
+                view_changed = track_zoom and panel_detail_level(new_zoom) != panel_detail_level(panel_zoom)
+                st.session_state.map_zoom = new_zoom
+            if show_grid:
+                if out.get('center'):
+                    st.session_state.map_center = [out['center']['lat'], out['center']['lng']]
+                # Görünüm yuvarlanmış şebeke kutusundan çıkınca şebeke yeni görünüme göre hazırlanır
+                new_bounds = snap_view_bounds(out.get('bounds'))
+                if new_bounds and new_bounds != st.session_state.get('map_bounds'):
+                    st.session_state.map_bounds = new_bounds
+                    view_changed = True
+            if view_changed:
+                st.rerun()
 
     with col2:
         st.subheader("📊 Analiz Sonuçları")
@@ -405,6 +481,34 @@ else:
         k1.metric("Rakım", f"{rakim} m");
         k2.metric("Eğim", f"%{egim}")
 
+        if st.session_state.parsel_geojson:
+            with st.expander("⛰️ Parsel Arazi İstatistikleri", expanded=False):
+                with st.spinner("Parsel arazisi analiz ediliyor..."):
+                    t_stats = parcel_terrain_stats(st.session_state.parsel_geojson["features"][0]["geometry"])
+                if not t_stats or not t_stats["slope"]:
+                    st.info("Parsel için arazi verisi alınamadı.")
+                else:
+                    p1, p2, p3 = st.columns(3)
+                    p1.metric("Ort. Eğim", f"{t_stats['slope']['mean']:.1f}°")
+                    p2.metric(f"Eğim ≤ {USABLE_SLOPE:.0f}°", f"%{t_stats['usable_fraction'] * 100:.0f}",
+                              help=f"≈ {t_stats['usable_fraction'] * real_area_m2:,.0f} m² kullanılabilir alan")
+                    if t_stats["elevation"]:
+                        p3.metric("Kot Farkı",
+                                  f"{t_stats['elevation']['max'] - t_stats['elevation']['min']:.0f} m")
+
+                    st.caption("Eğim Sınıfları (alan %)")
+                    st.bar_chart(pd.DataFrame({"Alan %": [v * 100 for v in t_stats["slope_classes"].values()]},
+                                              index=list(t_stats["slope_classes"].keys())))
+                    st.caption("Bakı Dağılımı (alan %)")
+                    st.bar_chart(pd.DataFrame({"Alan %": [v * 100 for v in t_stats["aspect_sectors"].values()]},
+                                              index=list(t_stats["aspect_sectors"].keys())))
+
+                    rows = {"Rakım (m)": t_stats["elevation"], "Eğim (°)": t_stats["slope"]}
+                    st.dataframe(pd.DataFrame({k: [round(v[f"p{p}"], 1) for p in PERCENTILES]
+                                               for k, v in rows.items() if v},
+                                              index=[f"%{p}" for p in PERCENTILES]), use_container_width=True)
+                    st.caption(f"SRTM 90 m ızgarasında {t_stats['cells']} hücre üzerinden hesaplanmıştır.")
+
         grid_dist, grid_name = get_nearest_grid_distance(st.session_state.lat, st.session_state.lon)
         if grid_dist is not None:
             has_grid_perm = has_permission(st.session_state.user_role, "tm_proximity")
@@ -464,9 +568,87 @@ else:
 
             s_col1, s_col2 = st.columns(2)
             # 🎯 EKLENDİ: Dizi aralığı ve çekme mesafesi (setback) kullanıcıya açıldı
-            row_spacing_val = s_col1.number_input("Dizi Mesafesi (m)", value=3.5, step=0.1, format="%.1f")
+            row_spacing_val = s_col1.number_input("Dizi Mesafesi (m)", min_value=0.0, step=0.1, format="%.1f",
+                                                  value=st.session_state.get('row_spacing_suggest', 3.5))
             setback_val = s_col2.number_input("Çekme Mesafesi (m)", value=1.0, step=0.5, format="%.1f")
 
+            # ☀️ Gölgesiz dizi mesafesi: 21 Aralık 10:00-14:00 arası sıralar birbirini gölgelemez
+            if st.button("☀️ Gölgesiz Dizi Mesafesi Hesapla", use_container_width=True):
+                _, t_depth = table_size(PANEL_LIBRARY[p_brand][p_model].get("width", 1.134),
+                                        PANEL_LIBRARY[p_brand][p_model].get("height", 2.279), t_r, t_c)
+                ns_slope = slope_toward_south(egim, baki)
+                pitch_res = minimum_row_pitch(st.session_state.lat, t_depth, st.session_state.panel_tilt,
+                                              slope=ns_slope)
+                st.session_state.row_spacing_suggest = math.ceil(pitch_res["row_spacing"] * 10) / 10
+                st.session_state.pitch_tradeoff = (pitch_res, pitch_tradeoff(
+                    st.session_state.lat, t_depth, st.session_state.panel_tilt, slope=ns_slope))
+                st.rerun()
+
+            if st.session_state.get('pitch_tradeoff'):
+                pitch_res, pitch_df = st.session_state.pitch_tradeoff
+                c_hour = pitch_res['critical_hour']
+                st.caption(f"☀️ Min. aralık (pitch): {pitch_res['pitch']} m | GCR: {pitch_res['gcr']} | "
+                           f"Kritik an: {int(c_hour):02d}:{int(round(c_hour % 1 * 60)):02d}, "
+                           f"güneş {pitch_res['sun_elevation']}°")
+                if st.toggle("📉 Aralık / Kapasite / Gölge Kaybı Dengesi", value=False):
+                    st.dataframe(pitch_df.rename(columns={
+                        "pitch_m": "Pitch (m)", "row_spacing_m": "Dizi (m)", "gcr": "GCR",
+                        "shading_loss_pct": "Gölge Kaybı (%)", "relative_capacity": "Göreli Kapasite",
+                        "relative_energy": "Göreli Enerji", "shade_free": "Gölgesiz"}),
+                        use_container_width=True, hide_index=True)
+
+            a_col1, a_col2 = st.columns(2)
+            auto_azimuth = a_col1.toggle("🧭 Otomatik Yön", value=False,
+                                         help="Sıraları parsel kenarlarına hizalayan en iyi yönü arar")
+            max_dev_val = a_col2.number_input("Maks. Sapma (°)", value=30, min_value=0, max_value=90, step=5,
+                                              disabled=not auto_azimuth)
+
+            # Yasak alanlar (kuyu, direk, yol vb.): Çekme payı kadar genişletilerek yerleşim dışı tutulur
+            excl_file = st.file_uploader("⛔ Yasak Alanlar (Opsiyonel GeoJSON)", type=["geojson", "json"])
+            exclusion_geoms = None
+            if excl_file:
+                try:
+                    excl_data = json.load(excl_file)
+                    exclusion_geoms = [f["geometry"] for f in excl_data.get("features", []) if f.get("geometry")]
+                except (ValueError, AttributeError):
+                    st.warning("Yasak alan dosyası okunamadı.")
+
+            # ⛰️ Arazi filtresi: Maks. eğimi aşan ve kuzeye bakan hücrelere masa konmaz (SRTM)
+            tr_col1, tr_col2 = st.columns(2)
+            terrain_on = tr_col1.toggle("⛰️ Arazi Filtresi", value=False)
+            max_slope_val = tr_col2.number_input("Maks. Eğim (°)", value=15.0, min_value=1.0, max_value=45.0,
+                                                 step=1.0, disabled=not terrain_on)
+            exclude_north_val = st.checkbox("Kuzeye bakan yamaçları hariç tut", value=True, disabled=not terrain_on)
+
+            def _terrain_kwargs():
+                """Arazi filtresi açıksa parselin eğim/bakı rasterı (yalnızca hesaplama anında çekilir)."""
+                if not terrain_on:
+                    return {}
+                raster = get_terrain_raster(shape(st.session_state.parsel_geojson["features"][0]["geometry"]).bounds)
+                if raster is None:
+                    st.warning("⚠️ Arazi verisi çekilemedi, arazi filtresi uygulanmadı.")
+                    return {}
+                return {"terrain": raster, "max_slope": max_slope_val, "exclude_north": exclude_north_val}
+
+            if st.session_state.layout_data and st.session_state.layout_data.get("azimuth"):
+                st.caption(f"🧭 Yerleşim yönü: Güneyden {st.session_state.layout_data['azimuth']:+.1f}° "
+                           f"({'batı' if st.session_state.layout_data['azimuth'] > 0 else 'doğu'})")
+
+            if st.session_state.layout_data and st.session_state.layout_data.get("terrain_excluded"):
+                st.caption(f"⛰️ Arazi filtresiyle elenen masa: {st.session_state.layout_data['terrain_excluded']}")
+
+            layout_parts = (st.session_state.layout_data or {}).get("parts", [])
+            bad_parts = [p["part"] for p in layout_parts if p.get("status") in ("geçersiz", "boş")]
+            if bad_parts:
+                st.warning(f"⚠️ Geçersiz / boş geometri nedeniyle yerleşim yapılamayan parça: "
+                           f"{', '.join(map(str, bad_parts))}")
+            if len(layout_parts) > 1 or bad_parts:
+                st.dataframe(pd.DataFrame(layout_parts).rename(columns={
+                    "part": "Parça", "area_m2": "Alan (m²)", "tables": "Masa", "count": "Panel",
+                    "capacity_kw": "Kapasite (kWp)", "skipped_rows": "Boş Sıra",
+                    "terrain_excluded": "Arazi Eleme", "status": "Geometri", "note": "Not"}).set_index("Parça").round(1),
+                    use_container_width=True)
+
             if st.button("🚀 Hesapla ve Yerleştir", type="primary", use_container_width=True):
                 if not st.session_state.parsel_geojson:
                     st.error("⚠️ Önce bir parsel yüklemelisiniz! Sol menüdeki '🗺️ Parsel' sekmesini kullanın.")
@@ -474,18 +656,80 @@ else:
                     st.warning("🔒 Bu özellik Professional pakete dahildir.")
                 else:
                     with st.spinner("Hesaplanıyor..."):
-                        l_res = SolarLayoutEngine(
-                            st.session_state.parsel_geojson["features"][0]["geometry"]).generate_layout(
+                        engine = get_layout_engine(st.session_state.parsel_geojson["features"][0]["geometry"],
+                                                   exclusions=exclusion_geoms)
+                        layout_params = dict(
                             panel_width=PANEL_LIBRARY[p_brand][p_model].get("width", 1.134),
                             panel_height=PANEL_LIBRARY[p_brand][p_model].get("height", 2.279),
                             setback=setback_val,  # Sabit 1.0 yerine dinamik değer
                             row_spacing=row_spacing_val,  # Sabit 3.5 yerine dinamik değer
                             col_spacing=0.5,
                             table_rows=t_r,
-                            table_cols=t_c)
+                            table_cols=t_c,
+                            **_terrain_kwargs())
+                        if auto_azimuth:
+                            l_res = engine.optimize_azimuth(**layout_params, max_deviation=max_dev_val)
+                        else:
+                            l_res = engine.generate_layout(**layout_params)
                         st.session_state.layout_data = l_res
                         st.rerun()
 
+        with st.expander("🔁 Yerleşim Taraması (Çoklu Senaryo)", expanded=False):
+            # Tek tıkla onlarca kombinasyon: Tüm çekirdeklerde paralel çalışır
+            sw_types = st.multiselect("Sehpa Tipleri", list(TABLE_TYPES.keys()), default=list(TABLE_TYPES.keys()))
+            sw_row = st.slider("Dizi Mesafesi Aralığı (m)", 1.0, 10.0, (3.0, 5.0), step=0.5)
+            sw_set = st.slider("Çekme Mesafesi Aralığı (m)", 0.0, 20.0, (1.0, 1.0), step=0.5)
+            sw_az_col1, sw_az_col2 = st.columns(2)
+            sw_az = sw_az_col1.slider("Azimut Aralığı (°)", -45, 45, (0, 0), step=5)
+            sw_az_step = sw_az_col2.number_input("Azimut Adımı (°)", value=10, min_value=1, max_value=45, step=1)
+
+            def _sweep_range(lo, hi, step):
+                return [round(lo + i * step, 2) for i in range(int(round((hi - lo) / step)) + 1)]
+
+            if st.button("🔁 Taramayı Başlat", use_container_width=True):
+                if not st.session_state.parsel_geojson:
+                    st.error("⚠️ Önce bir parsel yüklemelisiniz! Sol menüdeki '🗺️ Parsel' sekmesini kullanın.")
+                elif not has_permission(st.session_state.user_role, "panel_placement"):
+                    st.warning("🔒 Bu özellik Professional pakete dahildir.")
+                elif not sw_types:
+                    st.warning("En az bir sehpa tipi seçin.")
+                else:
+                    with st.spinner("Senaryolar hesaplanıyor..."):
+                        st.session_state.sweep_results = sweep_layouts(
+                            st.session_state.parsel_geojson["features"][0]["geometry"],
+                            panel_width=PANEL_LIBRARY[p_brand][p_model].get("width", 1.134),
+                            panel_height=PANEL_LIBRARY[p_brand][p_model].get("height", 2.279),
+                            row_spacings=_sweep_range(sw_row[0], sw_row[1], 0.5),
+                            setbacks=_sweep_range(sw_set[0], sw_set[1], 0.5),
+                            table_types=sw_types,
+                            azimuths=_sweep_range(sw_az[0], sw_az[1], sw_az_step),
+                            exclusions=exclusion_geoms,
+                            **_terrain_kwargs())
+
+            sweep_df = st.session_state.sweep_results
+            if sweep_df is not None and not sweep_df.empty:
+                st.dataframe(sweep_df.rename(columns={
+                    "table_type": "Sehpa", "row_spacing": "Dizi (m)", "setback": "Çekme (m)", "azimuth": "Azimut (°)",
+                    "capacity_kw": "Kapasite (kWp)", "count": "Panel", "tables": "Masa", "skipped_rows": "Boş Sıra"}),
+                    use_container_width=True, height=250)
+                if st.button("✅ En İyi Senaryoyu Uygula", use_container_width=True):
+                    best = sweep_df.iloc[0]
+                    b_r, b_c = TABLE_TYPES[best["table_type"]]
+                    with st.spinner("Hesaplanıyor..."):
+                        st.session_state.layout_data = get_layout_engine(
+                            st.session_state.parsel_geojson["features"][0]["geometry"],
+                            exclusions=exclusion_geoms).generate_layout(
+                            panel_width=PANEL_LIBRARY[p_brand][p_model].get("width", 1.134),
+                            panel_height=PANEL_LIBRARY[p_brand][p_model].get("height", 2.279),
+                            setback=float(best["setback"]),
+                            row_spacing=float(best["row_spacing"]),
+                            col_spacing=0.5,
+                            table_rows=b_r,
+                            table_cols=b_c,
+                            azimuth=float(best["azimuth"]),
+                            **_terrain_kwargs())
+                    st.rerun()
+
         if has_permission(st.session_state.user_role, "financials") and res_prod > 0:
             st.markdown("### 💰 Finansal Özet")
             st.metric("Üretim", f"{int(res_prod):,} kWh");
@@ -1,10 +1,74 @@
+import os
+import re
+import math
+import json
+import hashlib
 import folium
-from folium.plugins import MarkerCluster, LocateControl
-from gis_service import parse_grid_data, get_substation_data
-from ui_utils import create_substation_popup
+import numpy as np
+import shapely
+from folium.plugins import FastMarkerCluster, LocateControl
+from gis_service import get_substation_data, TEIAS_CAPACITY_PATH
+from grid_index import get_grid_index
 from equipment_db import PANEL_LIBRARY
+from layout_engine import as_panel_tables
+from ui_utils import create_substation_popup
 import streamlit as st
 
+# --- TEİAŞ KATMANI DETAY SEVİYELERİ ---
+TEIAS_SIMPLIFY_LEVELS = (0.0001, 0.0005, 0.002, 0.008)  # Derece (~10 m ... ~800 m)
+TEIAS_VIEW_RADIUS = 0.5  # İlk render'da (görünüm henüz bilinmezken) merkezden şebeke çizim yarıçapı (Derece, ~50 km)
+TEIAS_VIEW_SNAP_MIN = 0.25  # Görünüm kutusunun yuvarlandığı en küçük ızgara adımı (Derece)
+TEIAS_VOLTAGE_COLORS = {"380 kV": "#d62728", "154 kV": "blue", "66 kV": "#2ca02c"}
+
+# Trafo noktaları tarayıcıda kümelenir; popup HTML'i sadece tıklanınca üretilir.
+# row: [lat, lon, hat_ismi, gerilim, bos_mw, renk, teias_ismi]
+TEIAS_ROW_FIELDS = {"name": 6, "voltage": 3, "free_mw": 4, "color": 5}
+
+
+def _substation_popup_js():
+    """
+    ui_utils.create_substation_popup çıktısını JS ifadesine çevirir (tek kaynak): alanlar yer tutucularla
+    doldurulup row[i] birleştirmesine dönüştürülür.
+    """
+    html = create_substation_popup({key: f"@@{idx}@@" for key, idx in TEIAS_ROW_FIELDS.items()}, ("@@0@@", "@@1@@"))
+    parts = re.split(r"@@(\d+)@@", html)
+    return " + ".join(f"row[{part}]" if i % 2 else json.dumps(part) for i, part in enumerate(parts))
+
+
+TEIAS_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 8, color: row[5], fillColor: row[5], fill: true, fillOpacity: 1});
+    marker.bindTooltip(row[2]);
+    marker.bindPopup(function () {
+        return %s;
+    }, {maxWidth: 260});
+    return marker;
+}
+""" % _substation_popup_js()
+
+
+def get_map_fingerprint(lat, lon, basemap, show_grid, parsel_geojson, layout_data, selected_brand, selected_model,
+                        analysis_results=None, auto_locate=False, zoom=None, view_bounds=None):
+    """
+    Haritanın görünümünü belirleyen durumun özeti (parmak izi).
+    Parmak izi değişmediyse önceki rerun'da hazırlanan katman verileri (prepare_*_layer) aynen kullanılabilir.
+    zoom: st_folium'un döndürdüğü zoom; sadece panel detay eşiğinin hangi tarafında olduğu parmak izine girer.
+    view_bounds: şebeke katmanının hazırlandığı (yuvarlanmış) görünüm kutusu.
+    """
+    digest = hashlib.md5()
+    digest.update(repr((round(lat, 7), round(lon, 7), basemap, bool(show_grid), selected_brand, selected_model,
+                        bool(auto_locate), panel_detail_level(zoom), view_bounds)).encode("utf-8"))
+    digest.update(json.dumps(parsel_geojson, sort_keys=True, default=str).encode("utf-8"))
+    if layout_data:
+        digest.update(repr((layout_data.get('capacity_kw'), layout_data.get('count'))).encode("utf-8"))
+        digest.update(as_panel_tables(layout_data.get('panels')).digest().encode("utf-8"))
+        digest.update(json.dumps(layout_data.get('kiosk'), default=str).encode("utf-8"))
+    if analysis_results:
+        # Parsel tooltip'inde gösterilen değerler
+        digest.update(repr((analysis_results.get("area"), analysis_results.get("production"))).encode("utf-8"))
+    return digest.hexdigest()
+
 
 def create_base_map(lat, lon, tile_config, auto_locate=False):
     """
@@ -33,33 +97,139 @@ def create_base_map(lat, lon, tile_config, auto_locate=False):
     return m
 
 
-def add_teias_layer(m):
-    """TEİAŞ Şebeke verilerini haritaya ekler."""
-    import os
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    geojson_path = os.path.join(base_dir, "data", "sebeke_verisi.geojson")
-
-    if os.path.exists(geojson_path):
-        grid_data = parse_grid_data(geojson_path)
-        if grid_data:
-            marker_cluster = MarkerCluster(name="Trafo Merkezleri").add_to(m)
-            for item in grid_data:
-                if item['type'] == 'Point':
-                    teias_live_data = get_substation_data(item['name'])
-                    popup_html = create_substation_popup(teias_live_data, item['coords'])
-                    folium.CircleMarker(
-                        location=item['coords'], radius=8,
-                        color=teias_live_data['color'], fill=True, fill_opacity=1,
-                        popup=folium.Popup(popup_html, max_width=260),
-                        tooltip=f"{item['name']}"
-                    ).add_to(marker_cluster)
-                elif item['type'] == 'Line':
-                    folium.PolyLine(
-                        item['path'], color="blue", weight=2, opacity=0.4,
-                        tooltip=f"ENH: {item['name']}"
-                    ).add_to(m)
-            return True
-    return False
+def get_view_bounds(lat, lon, radius=TEIAS_VIEW_RADIUS):
+    """Harita merkezine göre [[güney, batı], [kuzey, doğu]] görünüm kutusu."""
+    return [[lat - radius, lon - radius], [lat + radius, lon + radius]]
+
+
+def snap_view_bounds(map_bounds, min_step=TEIAS_VIEW_SNAP_MIN):
+    """
+    st_folium'un döndürdüğü sınırları ({"_southWest": {...}, "_northEast": {...}}) [[güney, batı], [kuzey, doğu]]
+    kutusuna çevirir; kutu, görünüm boyutuna göre seçilen 2'nin kuvveti adımlı ızgaraya dışarı doğru genişletilir.
+    Böylece küçük kaydırmalarda kutu (ve hazırlanan şebeke katmanı) değişmez. Geçersiz sınırlarda None döner.
+    """
+    try:
+        sw, ne = map_bounds["_southWest"], map_bounds["_northEast"]
+        south, west, north, east = float(sw["lat"]), float(sw["lng"]), float(ne["lat"]), float(ne["lng"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not all(map(math.isfinite, (south, west, north, east))) or north <= south or east <= west:
+        return None
+    # Adım görünüm genişliğinin yarısı ile tamamı arasında: kutu en fazla ~3 görünüm genişliği olur
+    step = max(min_step, 2.0 ** math.floor(math.log2(max(north - south, east - west))))
+    return [[math.floor(south / step) * step, math.floor(west / step) * step],
+            [math.ceil(north / step) * step, math.ceil(east / step) * step]]
+
+
+def _voltage_class(name):
+    """'154kV_ASKALE TM - ...' -> '154 kV'"""
+    match = re.match(r'\s*(\d+)\s*kV', name, re.IGNORECASE)
+    return f"{match.group(1)} kV" if match else "Diğer"
+
+
+_TEIAS_LAYER_CACHE = {}
+
+
+def _prepare_teias_layer():
+    """
+    Şebeke katmanının sunucu tarafı hazırlığı (süreç başına bir kez).
+    Şebeke indeksi veya kapasite dosyası değişince yeniden kurulur.
+    """
+    grid_index = get_grid_index()
+    if grid_index is None or not len(grid_index):
+        return None
+    cap_mtime = os.path.getmtime(TEIAS_CAPACITY_PATH) if os.path.exists(TEIAS_CAPACITY_PATH) else None
+    cached = _TEIAS_LAYER_CACHE.get("layer")
+    if cached and cached[0] is grid_index and cached[1] == cap_mtime:
+        return cached[2]
+
+    line_ids = np.flatnonzero(grid_index.kinds == "Line")
+    lines = grid_index.geoms[line_ids]
+    subs = []
+    for i in grid_index.substation_ids:
+        geom, data = grid_index.geoms[i], get_substation_data(grid_index.names[i])
+        subs.append([round(geom.y, 5), round(geom.x, 5), grid_index.names[i], data['voltage'], data['free_mw'],
+                     data['color'], data['name']])
+
+    layer = {
+        "lines": lines,
+        "line_bounds": shapely.bounds(lines).reshape(-1, 4),
+        "line_classes": np.array([_voltage_class(grid_index.names[i]) for i in line_ids]),
+        "simplified": {},
+        "subs": subs,
+        "sub_latlon": np.array([s[:2] for s in subs], dtype=float).reshape(-1, 2),
+    }
+    _TEIAS_LAYER_CACHE["layer"] = (grid_index, cap_mtime, layer)
+    return layer
+
+
+def _simplified_lines(layer, span_deg):
+    """Görünüm genişliğine uygun toleransla sadeleştirilmiş hatlar (seviye başına bir kez hesaplanır)."""
+    target = span_deg / 1000.0  # ~1 piksel
+    level = max([t for t in TEIAS_SIMPLIFY_LEVELS if t <= target], default=TEIAS_SIMPLIFY_LEVELS[0])
+    if level not in layer["simplified"]:
+        simplified = shapely.simplify(layer["lines"], level, preserve_topology=False)
+        layer["simplified"][level] = shapely.set_precision(simplified, 1e-5)
+    return layer["simplified"][level]
+
+
+def prepare_teias_layer(bounds=None, margin=0.2):
+    """
+    TEİAŞ katmanının haritaya eklenecek verisi (GeoJSON sözlükleri + trafo satırları); folium objesi içermez.
+    bounds: [[güney, batı], [kuzey, doğu]]; verilirse sadece bu alan (+ margin oranı) içindeki veriler alınır.
+    Hatlar ölçeğe göre sadeleştirilip gerilim sınıfı başına tek feature'da birleştirilir.
+    Dönüş: {"lines": [(gerilim sınıfı, renk, feature)], "subs": [...]} veya None
+    """
+    layer = _prepare_teias_layer()
+    if not layer:
+        return None
+
+    line_mask = np.ones(len(layer["lines"]), dtype=bool)
+    sub_mask = np.ones(len(layer["subs"]), dtype=bool)
+    span = 20.0  # Türkiye geneli
+    if bounds:
+        (south, west), (north, east) = bounds
+        pad_lat, pad_lon = (north - south) * margin, (east - west) * margin
+        south, north, west, east = south - pad_lat, north + pad_lat, west - pad_lon, east + pad_lon
+        lb = layer["line_bounds"]
+        line_mask = (lb[:, 0] <= east) & (lb[:, 2] >= west) & (lb[:, 1] <= north) & (lb[:, 3] >= south)
+        s_lat, s_lon = layer["sub_latlon"][:, 0], layer["sub_latlon"][:, 1]
+        sub_mask = (s_lat >= south) & (s_lat <= north) & (s_lon >= west) & (s_lon <= east)
+        span = max(north - south, east - west)
+
+    lines = _simplified_lines(layer, span)
+    line_layers = []
+    for v_class in np.unique(layer["line_classes"][line_mask]):
+        parts = lines[line_mask & (layer["line_classes"] == v_class)]
+        parts = parts[~shapely.is_empty(parts)]
+        if not len(parts): continue
+        line_layers.append((str(v_class), TEIAS_VOLTAGE_COLORS.get(v_class, "#555555"),
+                            {"type": "Feature", "properties": {"kv": str(v_class)},
+                             "geometry": json.loads(shapely.to_geojson(shapely.multilinestrings(parts)))}))
+
+    return {"lines": line_layers, "subs": [row for row, keep in zip(layer["subs"], sub_mask) if keep]}
+
+
+def add_teias_layer(m, bounds=None, margin=0.2, prepared=None):
+    """
+    TEİAŞ Şebeke verilerini haritaya ekler.
+    prepared: prepare_teias_layer çıktısı (önbellekten); verilmezse bounds/margin ile hazırlanır.
+    """
+    prepared = prepared if prepared is not None else prepare_teias_layer(bounds, margin)
+    if not prepared:
+        return False
+
+    for v_class, color, feature in prepared["lines"]:
+        folium.GeoJson(
+            feature,
+            name=f"ENH {v_class}",
+            style_function=lambda x, c=color: {'color': c, 'weight': 2, 'opacity': 0.4},
+            tooltip=f"ENH: {v_class}"
+        ).add_to(m)
+
+    if prepared["subs"]:
+        FastMarkerCluster(prepared["subs"], callback=TEIAS_MARKER_CALLBACK, name="Trafo Merkezleri").add_to(m)
+    return True
 
 
 def add_parsel_layer(m, parsel_geojson, analysis_results, layout_data):
@@ -99,44 +269,110 @@ def add_parsel_layer(m, parsel_geojson, analysis_results, layout_data):
     ).add_to(m)
 
 
-def add_panel_layer(m, layout_data, selected_brand, selected_model):
-    """Panel yerleşimini haritaya çizer."""
+PANEL_DETAIL_MAX_TABLES = 2000  # Bu sayının üzerinde masalar sıra blokları halinde birleştirilir
+PANEL_DETAIL_ZOOM = 19  # Bu zoom ve üzeri her zaman masa masa çizilir
+PANEL_COORD_PRECISION = 6  # ~0.1 m
+
+
+def panel_detail_level(zoom, detail_zoom=PANEL_DETAIL_ZOOM):
+    """Zoom, masa masa detay eşiğinde veya üzerinde mi (zoom bilinmiyorsa False)."""
+    return zoom is not None and zoom >= detail_zoom
+
+
+def needs_zoom_tracking(layout_data, max_detail_tables=PANEL_DETAIL_MAX_TABLES):
+    """
+    Yerleşim, zoom'a göre sıra bloğu / masa detayı arasında geçiş gerektirecek kadar büyük mü.
+    Küçük yerleşimler her zoom'da detaylı çizildiği için zoom takibi (ve her zoomda rerun) gereksizdir.
+    """
+    return bool(layout_data) and len(as_panel_tables(layout_data.get("panels"))) > max_detail_tables
+
+
+def _aggregate_panel_features(panels, properties, precision=PANEL_COORD_PRECISION):
+    """
+    Masaları sıra bloklarına (parça + sıra numarası) göre gruplar; her blok TEK MultiPolygon feature olur.
+    Koordinatlar quantize edilir, özellikler (marka/model/güç) blok başına bir kez yazılır.
+    """
+    rings = panels.rings(precision)
+    _, row_ids = np.unique(np.column_stack([panels.part, panels.row]), axis=0, return_inverse=True)
+    row_ids = row_ids.ravel()
+
+    features = []
+    for row_id in np.unique(row_ids):
+        block = rings[row_ids == row_id]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "MultiPolygon", "coordinates": [[ring] for ring in block.tolist()]},
+            "properties": dict(properties, masa=f"{len(block)} Masa")
+        })
+    return features
+
+
+def prepare_panel_layer(layout_data, selected_brand, selected_model, zoom=None,
+                        detail_zoom=PANEL_DETAIL_ZOOM, max_detail_tables=PANEL_DETAIL_MAX_TABLES):
+    """
+    Panel katmanının haritaya eklenecek verisi (köşk + GeoJSON FeatureCollection); folium objesi içermez.
+    Büyük yerleşimlerde (max_detail_tables üzeri) masalar sıra blokları halinde birleştirilir;
+    zoom >= detail_zoom ise her zaman masa masa detay hazırlanır.
+    Dönüş: {"kiosk", "collection", "fields", "aliases"} veya None
+    """
     if not layout_data:
+        return None
+
+    current_panel_data = PANEL_LIBRARY[selected_brand][selected_model]
+    properties = {
+        "marka": f"{selected_brand}",
+        "model": f"{selected_model}",
+        "guc": f"{current_panel_data['p_max']} Wp"
+    }
+    fields, aliases = ["marka", "model", "guc"], ["Marka:", "Model:", "Güç:"]
+
+    geojson_features = []
+    panels = as_panel_tables(layout_data.get("panels"))
+    if len(panels):
+        detail = len(panels) <= max_detail_tables or panel_detail_level(zoom, detail_zoom)
+        if detail:
+            geojson_features = panels.to_geojson_features(properties)
+        else:
+            geojson_features = _aggregate_panel_features(panels, properties)
+            fields, aliases = fields + ["masa"], aliases + ["Sıra:"]
+
+    return {
+        "kiosk": layout_data.get("kiosk"),
+        "collection": {"type": "FeatureCollection", "features": geojson_features} if geojson_features else None,
+        "fields": fields,
+        "aliases": aliases,
+    }
+
+
+def add_panel_layer(m, layout_data, selected_brand, selected_model, zoom=None,
+                    detail_zoom=PANEL_DETAIL_ZOOM, max_detail_tables=PANEL_DETAIL_MAX_TABLES, prepared=None):
+    """
+    Panel yerleşimini haritaya çizer.
+    prepared: prepare_panel_layer çıktısı (önbellekten); verilmezse diğer parametrelerle hazırlanır.
+    """
+    if prepared is None:
+        prepared = prepare_panel_layer(layout_data, selected_brand, selected_model, zoom=zoom,
+                                       detail_zoom=detail_zoom, max_detail_tables=max_detail_tables)
+    if not prepared:
         return False
 
-    if "kiosk" in layout_data and layout_data["kiosk"]:
+    if prepared["kiosk"]:
         folium.Polygon(
-            locations=layout_data["kiosk"], color="#444444", fill=True,
+            locations=prepared["kiosk"], color="#444444", fill=True,
             fill_color="#777777", fill_opacity=0.9, popup="Trafo Köşkü"
         ).add_to(m)
 
-    current_panel_data = PANEL_LIBRARY[selected_brand][selected_model]
-
-    geojson_features = []
-    if "panels" in layout_data and layout_data["panels"]:
-        for p_coords in layout_data["panels"]:
-            poly_coords = [list(c) for c in p_coords]
-            geojson_features.append({
-                "type": "Feature",
-                "geometry": {"type": "Polygon", "coordinates": [poly_coords]},
-                "properties": {
-                    "marka": f"{selected_brand}",
-                    "model": f"{selected_model}",
-                    "guc": f"{current_panel_data['p_max']} Wp"
-                }
-            })
-
-    if geojson_features:
+    if prepared["collection"]:
         panel_tooltip = folium.GeoJsonTooltip(
-            fields=["marka", "model", "guc"],
-            aliases=["Marka:", "Model:", "Güç:"],
+            fields=prepared["fields"],
+            aliases=prepared["aliases"],
             style="background-color: white; border: 1px solid #1c5a7a; font-size: 11px;"
         )
         folium.GeoJson(
-            {"type": "FeatureCollection", "features": geojson_features},
+            prepared["collection"],
             style_function=lambda x: {'fillColor': '#2b8cbe', 'color': '#1c5a7a', 'weight': 1, 'fillOpacity': 0.7},
             tooltip=panel_tooltip
         ).add_to(m)
         return True
 
-    return False
\ No newline at end of file
+    return False
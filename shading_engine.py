@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# --- GÖLGELEME MOTORU (Sıralar Arası Gölge / Dizi Mesafesi) ---
+# Açı kuralları: Güneş ve panel azimutu güneyden ölçülür (+ batı, - doğu).
+# Saatler gerçek güneş saatidir (12:00 = güneş tepe noktasında).
+# Arazi eğimi (slope) sıra normali yönünde alınır: + kuzeye doğru yükselen (güneye bakan) arazi.
+
+WINTER_SOLSTICE_DOY = 355  # 21 Aralık
+SHADE_FREE_WINDOW = (10.0, 14.0)  # Gölgesiz olması istenen saat aralığı
+
+ASPECT_DEGREES = {"Kuzey": 0, "Kuzeydoğu": 45, "Doğu": 90, "Güneydoğu": 135,
+                  "Güney": 180, "Güneybatı": 225, "Batı": 270, "Kuzeybatı": 315}
+
+
+def solar_position(lat, day_of_year, solar_hour):
+    """
+    Vektörel güneş konumu (day_of_year ve solar_hour dizileri yayınlanır / broadcast).
+    Dönüş: (yükseklik açısı °, azimut ° güneyden + batı)
+    """
+    phi = np.radians(lat)
+    day_of_year, solar_hour = np.asarray(day_of_year, dtype=float), np.asarray(solar_hour, dtype=float)
+    delta = np.radians(23.45 * np.sin(np.radians(360.0 * (284 + day_of_year) / 365.0)))  # Cooper
+    omega = np.radians(15.0 * (solar_hour - 12.0))
+
+    sin_alt = np.sin(phi) * np.sin(delta) + np.cos(phi) * np.cos(delta) * np.cos(omega)
+    altitude = np.arcsin(np.clip(sin_alt, -1.0, 1.0))
+    azimuth = np.arctan2(np.sin(omega), np.sin(phi) * np.cos(omega) - np.cos(phi) * np.tan(delta))
+    return np.degrees(altitude), np.degrees(azimuth)
+
+
+def slope_toward_south(slope_deg, aspect):
+    """
+    Arazi eğiminin güney-kuzey (sıra normali) bileşeni.
+    aspect: Pusula derecesi veya 'Güney', 'Kuzeybatı' ... (calculate_slope_aspect çıktısı)
+    Güneye bakan arazi +, kuzeye bakan arazi - döner.
+    """
+    aspect_deg = ASPECT_DEGREES.get(aspect, 180) if isinstance(aspect, str) else float(aspect)
+    return float(np.degrees(np.arctan(np.tan(np.radians(slope_deg)) * -np.cos(np.radians(aspect_deg)))))
+
+
+def _required_pitch(table_depth, tilt, altitude, sun_azimuth, slope=0.0, azimuth=0.0):
+    """
+    Verilen güneş konumlarında arka sırayı gölgelememek için gereken yatay sıra aralığı (pitch, m).
+    _shaded_fraction ile aynı kesit (profil) açısı modeli: tanψ = tanα / cosΔ, fs = 0 koşulundan
+    pitch = D·sin(β+ψ)·cosθ / sin(ψ+θ)   (θ = 0 için D·cosβ + h·cosΔ / tanα)
+    Güneş ufkun altındaysa veya panelin arkasındaysa (cosΔ <= 0) gereksinim D·cosβ'dır.
+    """
+    beta, theta = np.radians(tilt), np.radians(slope)
+    alpha = np.radians(altitude)
+    cos_d = np.cos(np.radians(sun_azimuth - azimuth))
+    footprint = table_depth * np.cos(beta)
+
+    lit = (alpha > 0) & (cos_d > 0)
+    psi = np.arctan2(np.tan(np.where(lit, alpha, 0.0)), np.where(lit, cos_d, 1.0))
+    # Güneş kesitte arazi düzleminin altındaysa (ψ + θ <= 0) gölge kaçınılmazdır; 1° ile sınırlanır (çok büyük pitch)
+    sin_pt = np.maximum(np.sin(psi + theta), np.sin(np.radians(1.0)))
+    pitch = table_depth * np.sin(beta + psi) * np.cos(theta) / sin_pt
+    return np.where(lit, np.maximum(pitch, footprint), footprint)
+
+
+def minimum_row_pitch(lat, table_depth, tilt, slope=0.0, azimuth=0.0, day_of_year=WINTER_SOLSTICE_DOY,
+                      window=SHADE_FREE_WINDOW, step_min=5):
+    """
+    Hedef saat aralığında (varsayılan 21 Aralık 10:00-14:00) hiç sıra gölgesi olmayan en küçük sıra aralığı.
+    table_depth: Masanın eğimli (panel yüzeyi boyunca) derinliği, m
+    Dönüş: {"pitch", "row_spacing", "gcr", "critical_hour", "sun_elevation", "shaded_fraction" (kontrol, ~0)}
+    row_spacing, SolarLayoutEngine'in masa derinliğini düzlemde tam boy kabul etmesine göre verilir (pitch - D).
+    """
+    hours = np.arange(window[0], window[1] + 1e-9, step_min / 60.0)
+    altitude, sun_az = solar_position(lat, day_of_year, hours)
+    pitches = _required_pitch(table_depth, tilt, altitude, sun_az, slope, azimuth)
+    worst = int(np.argmax(pitches))
+    pitch = math.ceil(float(pitches[worst]) * 100.0 - 1e-6) / 100.0  # cm'ye yukarı: yuvarlanmış değer de gölgesiz
+    # Kontrol: Aynı kesit modeliyle pencere içindeki en büyük gölge oranı (~0 olmalı)
+    shading = float(_shaded_fraction([pitch], table_depth, tilt, altitude, sun_az, slope, azimuth).max())
+    return {
+        "pitch": pitch,
+        "row_spacing": round(max(pitch - table_depth, 0.0), 2),
+        "gcr": round(table_depth / pitch, 3) if pitch > 0 else 0.0,
+        "critical_hour": round(float(hours[worst]), 2),
+        "sun_elevation": round(float(altitude[worst]), 1),
+        "shaded_fraction": round(shading, 4),
+    }
+
+
+def _shaded_fraction(pitch, table_depth, tilt, altitude, sun_azimuth, slope=0.0, azimuth=0.0):
+    """
+    Arka sıranın gölgede kalan oranı (0-1), pitch x zaman matrisi olarak.
+    Kesit (profil) açısı ψ: tanψ = tanα / cosΔ;  fs = 1 - (P/cosθ)·sin(ψ+θ) / (D·sin(β+ψ))
+    """
+    beta, theta = np.radians(tilt), np.radians(slope)
+    cos_d = np.cos(np.radians(sun_azimuth - azimuth))
+    alpha = np.radians(altitude)
+    lit = (alpha > 0) & (cos_d > 0)
+    psi = np.arctan2(np.tan(np.where(lit, alpha, 0.0)), np.where(lit, cos_d, 1.0))
+
+    pitch = np.asarray(pitch, dtype=float)[:, None]
+    fs = 1.0 - (pitch / np.cos(theta)) * np.sin(psi + theta) / (table_depth * np.sin(beta + psi) + 1e-12)
+    return np.where(lit, np.clip(fs, 0.0, 1.0), 0.0)
+
+
+def pitch_tradeoff(lat, table_depth, tilt, pitches=None, slope=0.0, azimuth=0.0, step_hours=0.5):
+    """
+    Sıra aralığı - kapasite - yıllık gölge kaybı dengesi (tüm yıl, vektörel güneş geometrisi).
+    Işınım için basit açık gökyüzü modeli kullanılır (Meinel DNI + %10 yaygın); sonuçlar görecelidir.
+    Dönüş: DataFrame [pitch_m, row_spacing_m, gcr, shading_loss_pct, relative_capacity, relative_energy,
+                      shade_free]
+    """
+    min_pitch = minimum_row_pitch(lat, table_depth, tilt, slope, azimuth)["pitch"]
+    if pitches is None:
+        lo = table_depth + 0.5  # Yerleşim motoru masaları düzlemde tam derinlikte yerleştirir
+        pitches = np.round(np.linspace(lo, max(min_pitch * 1.3, lo + 1.0), 15), 2)
+    pitches = np.asarray(pitches, dtype=float)
+
+    days = np.arange(1, 366)[:, None]
+    hours = np.arange(step_hours / 2, 24.0, step_hours)[None, :]
+    altitude, sun_az = solar_position(lat, days, hours)
+    altitude, sun_az = altitude.ravel(), sun_az.ravel()
+
+    # Açık gökyüzü ışınımı ve panel düzlemine düşen bileşenler
+    alpha, beta = np.radians(altitude), np.radians(tilt)
+    air_mass = 1.0 / np.maximum(np.sin(alpha), 0.05)
+    dni = np.where(alpha > 0, 1353.0 * 0.7 ** (air_mass ** 0.678), 0.0)
+    cos_inc = np.sin(alpha) * np.cos(beta) + np.cos(alpha) * np.sin(beta) * np.cos(np.radians(sun_az - azimuth))
+    beam = dni * np.clip(cos_inc, 0.0, None)
+    diffuse = 0.1 * dni * (1 + np.cos(beta)) / 2.0
+
+    shaded = _shaded_fraction(pitches, table_depth, tilt, altitude, sun_az, slope, azimuth)
+    total = (beam + diffuse).sum()
+    loss = (shaded * beam).sum(axis=1) / total if total > 0 else np.zeros(len(pitches))
+
+    capacity = pitches.min() / pitches  # Aynı parselde sıra sayısı ~ 1 / pitch
+    energy = capacity * (1.0 - loss)
+    return pd.DataFrame({
+        "pitch_m": pitches,
+        "row_spacing_m": np.round(np.maximum(pitches - table_depth, 0.0), 2),
+        "gcr": np.round(table_depth / pitches, 3),
+        "shading_loss_pct": np.round(loss * 100.0, 2),
+        "relative_capacity": np.round(capacity, 3),
+        "relative_energy": np.round(energy / energy.max(), 3),
+        "shade_free": pitches >= min_pitch - 1e-9,
+    })
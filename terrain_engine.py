@@ -0,0 +1,311 @@
+import math
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from gis_service import fetch_srtm_elevation_data, OPENTOPOGRAPHY_API_KEY
+from dem_store import get_tile, crop_window, coalesce
+
+# --- ARAZİ (DEM) MOTORU: Eğim / Bakı / Gölgeli Kabartma Rasterları ---
+# Bakı pusula derecesidir (0 = Kuzey, 90 = Doğu, 180 = Güney); eğim derecedir.
+# Eğim/bakı Horn (3x3) çekirdeğiyle tüm pencere için tek seferde hesaplanır; hücre boyu enleme göre metredir.
+# Tam 1° karo rasterları karo başına bir kez üretilir ve bellekte tutulur; nokta sorguları dizi okumasıdır.
+
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON_EQUATOR = 111320.0
+NORTH_ASPECT_LIMIT = 45.0  # Kuzeyden bu açı içinde bakan hücreler "kuzeye bakan" sayılır
+MIN_ASPECT_SLOPE = 2.0  # Bu eğimin altında bakı anlamsızdır (düz arazi), kuzey filtresi uygulanmaz
+ASPECT_NAMES = ["Kuzey", "Kuzeydoğu", "Doğu", "Güneydoğu", "Güney", "Güneybatı", "Batı", "Kuzeybatı"]
+
+HILLSHADE_AZIMUTH = 315.0  # Işık kuzeybatıdan (kartografik standart)
+HILLSHADE_ALTITUDE = 45.0
+TERRAIN_CACHE_TILES = 4  # Bellekte tutulan karo rasterı sayısı (~25 MB / SRTM3 karo)
+WINDOW_PAD = 0.002  # Karodan kesilen pencerelerin dolgusu (fetch_srtm_elevation_data ile aynı)
+
+_TERRAIN_CACHE = OrderedDict()  # (lat, lon) -> karo rasterı
+_TERRAIN_LOCK = threading.Lock()
+
+# Parsel istatistikleri: eğim sınıfları (alt, üst, etiket), yüzdelikler, kullanılabilir eğim sınırı
+SLOPE_CLASSES = [(0, 5, "0-5°"), (5, 10, "5-10°"), (10, 15, "10-15°"), (15, 25, "15-25°"), (25, 90, ">25°")]
+PERCENTILES = (5, 25, 50, 75, 95)
+USABLE_SLOPE = 15.0
+ELEVATION_BINS = 10
+STATS_CACHE_SIZE = 32
+_STATS_CACHE = OrderedDict()  # parsel geometri özeti -> istatistik sözlüğü
+_STATS_LOCK = threading.Lock()
+
+
+def aspect_to_text(aspect_deg):
+    """Pusula derecesini 8 yönlü Türkçe bakı adına çevirir (0 -> 'Kuzey', 180 -> 'Güney')."""
+    return ASPECT_NAMES[int((float(aspect_deg) % 360.0 + 22.5) / 45.0) % 8]
+
+
+def _fill_nodata(z):
+    z = np.asarray(z, dtype=np.float32)
+    nodata = np.isnan(z)
+    if nodata.any():
+        z = np.where(nodata, np.nanmean(z) if not nodata.all() else 0.0, z).astype(np.float32)
+    return z
+
+
+def slope_aspect(z, x, y, hillshade=False):
+    """
+    DEM penceresinin tamamı için vektörel Horn (3x3) eğim ve bakı rasterları.
+    x: boylam ekseni, y: enlem ekseni (artan veya azalan). Doğu-batı hücre boyu her satırın enlemine göre
+    metreye çevrilir. Kenarlarda en yakın değer tekrarlanır.
+    Dönüş: (slope °, aspect pusula °) float32; hillshade=True ise (slope, aspect, hillshade 0-255)
+    """
+    z = _fill_nodata(z)
+    y = np.asarray(y, dtype=np.float64)
+    dx = (abs(x[1] - x[0]) * M_PER_DEG_LON_EQUATOR * np.cos(np.radians(y)))[:, None].astype(np.float32)
+    dy = np.float32(abs(y[1] - y[0]) * M_PER_DEG_LAT)
+
+    p = np.pad(z, 1, mode="edge")
+    top, mid, bot = p[:-2], p[1:-1], p[2:]  # Satır kaydırmaları (0. satır dizinin ilk satırıdır)
+    col_e = (top[:, 2:] + 2 * mid[:, 2:] + bot[:, 2:]) - (top[:, :-2] + 2 * mid[:, :-2] + bot[:, :-2])
+    row_d = (bot[:, :-2] + 2 * bot[:, 1:-1] + bot[:, 2:]) - (top[:, :-2] + 2 * top[:, 1:-1] + top[:, 2:])
+    dz_dx = col_e / (8 * dx)
+    dz_drow = row_d / (8 * dy)
+    dz_dn = -dz_drow if y[0] > y[-1] else dz_drow  # Kuzeye doğru değişim
+
+    slope = np.degrees(np.arctan(np.hypot(dz_dx, dz_dn)))
+    aspect = np.degrees(np.arctan2(-dz_dx, -dz_dn)) % 360.0  # En dik iniş yönü
+    if not hillshade:
+        return slope, aspect
+    return slope, aspect, hillshade_from(slope, aspect)
+
+
+def hillshade_from(slope, aspect, azimuth=HILLSHADE_AZIMUTH, altitude=HILLSHADE_ALTITUDE):
+    """Eğim/bakı rasterlarından gölgeli kabartma (0-255, uint8)."""
+    zenith, s = np.radians(90.0 - altitude), np.radians(slope)
+    shade = np.cos(zenith) * np.cos(s) + np.sin(zenith) * np.sin(s) * np.cos(np.radians(azimuth - aspect))
+    return np.rint(np.clip(shade, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def _build_raster(z, x, y):
+    slope, aspect, shade = slope_aspect(z, x, y, hillshade=True)
+    return {"x": x, "y": y, "z": np.asarray(z, dtype=np.float32), "slope": slope, "aspect": aspect,
+            "hillshade": shade}
+
+
+def _tile_raster(lat, lon):
+    try:
+        tile = get_tile(lat, lon, api_key=OPENTOPOGRAPHY_API_KEY)
+    except Exception as e:
+        print(f"DEM Tile Error: {e}")
+        return None
+    if tile is None:
+        return None
+    z = np.asarray(tile["z"], dtype=np.float32)
+    if tile["nodata"] is not None:
+        z[z == tile["nodata"]] = np.nan
+    x = tile["x0"] + np.arange(tile["ncols"]) * tile["cellsize"]
+    y = tile["y0"] - np.arange(tile["nrows"]) * tile["cellsize"]
+    return _build_raster(z, x, y)
+
+
+def get_tile_terrain(lat, lon):
+    """
+    (lat, lon) noktasını içeren 1° karonun tam rasterı {"x", "y", "z", "slope", "aspect", "hillshade"}.
+    Karo başına bir kez hesaplanır (eşzamanlı istekler birleştirilir), son TERRAIN_CACHE_TILES karo tutulur.
+    Karo alınamazsa None.
+    """
+    key = (math.floor(lat), math.floor(lon))
+    with _TERRAIN_LOCK:
+        if key in _TERRAIN_CACHE:
+            _TERRAIN_CACHE.move_to_end(key)
+            return _TERRAIN_CACHE[key]
+
+    raster = coalesce(("terrain",) + key, lambda: _tile_raster(*key))
+    if raster is not None:
+        with _TERRAIN_LOCK:
+            _TERRAIN_CACHE[key] = raster
+            while len(_TERRAIN_CACHE) > TERRAIN_CACHE_TILES:
+                _TERRAIN_CACHE.popitem(last=False)
+    return raster
+
+
+def get_terrain_raster(bbox):
+    """
+    bbox [min_lon, min_lat, max_lon, max_lat] için eğim/bakı/gölgeli kabartma rasterları.
+    Kutu tek bir karoya sığıyorsa karo rasterından kesilir (kenar hücreleri de doğru komşulukla hesaplanmış olur);
+    aksi halde SRTM penceresi çekilip yerinde hesaplanır.
+    Dönüş: {"x", "y", "z", "slope", "aspect", "hillshade"} veya None (veri yoksa)
+    """
+    west, south, east, north = (bbox[0] - WINDOW_PAD, bbox[1] - WINDOW_PAD,
+                                bbox[2] + WINDOW_PAD, bbox[3] + WINDOW_PAD)
+    if math.floor(west) == math.floor(east) and math.floor(south) == math.floor(north):
+        raster = get_tile_terrain(south, west)
+        if raster is not None:
+            return crop_window(raster, south, west, north, east)
+    return _window_raster(bbox)
+
+
+def _window_raster(bbox):
+    """Karo kullanılamadığında: SRTM penceresini çekip rasterları yerinde hesaplar."""
+    data = fetch_srtm_elevation_data(list(bbox))
+    if not data or not data.get('success') or data['z'] is None or min(np.shape(data['z'])) < 2:
+        return None
+    return _build_raster(data['z'], data['x'], data['y'])
+
+
+def sample_raster(raster, key, lon, lat):
+    """Düzenli ızgara rasterında en yakın hücre değerleri (vektörel indeks hesabı). Dışarıda kalanlar NaN."""
+    x, y, grid = raster["x"], raster["y"], raster[key]
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    col = np.rint((lon - x[0]) / (x[1] - x[0])).astype(np.int64)
+    row = np.rint((lat - y[0]) / (y[1] - y[0])).astype(np.int64)
+    inside = (col >= 0) & (col < grid.shape[1]) & (row >= 0) & (row < grid.shape[0])
+    values = np.full(lon.shape, np.nan)
+    values[inside] = grid[row[inside], col[inside]]
+    return values
+
+
+def sample_bilinear(raster, key, lon, lat):
+    """Düzenli ızgara rasterında çift doğrusal (bilinear) enterpolasyon. Dışarıda kalanlar NaN."""
+    x, y, grid = raster["x"], raster["y"], raster[key]
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    col_f = (lon - x[0]) / (x[1] - x[0])
+    row_f = (lat - y[0]) / (y[1] - y[0])
+    c0, r0 = np.floor(col_f).astype(np.int64), np.floor(row_f).astype(np.int64)
+    inside = (c0 >= 0) & (c0 < grid.shape[1] - 1) & (r0 >= 0) & (r0 < grid.shape[0] - 1)
+    c, r = c0[inside], r0[inside]
+    tx, ty = col_f[inside] - c, row_f[inside] - r
+    values = np.full(lon.shape, np.nan)
+    values[inside] = (grid[r, c] * (1 - tx) * (1 - ty) + grid[r, c + 1] * tx * (1 - ty) +
+                      grid[r + 1, c] * (1 - tx) * ty + grid[r + 1, c + 1] * tx * ty)
+    return values
+
+
+def terrain_at_point(lat, lon):
+    """
+    Tek nokta için rakım (bilinear), eğim ve bakı (en yakın hücre); karo rasterından dizi okumasıdır.
+    Karo yoksa nokta çevresindeki SRTM penceresi kullanılır.
+    Dönüş: {"elevation", "slope", "aspect"} veya None
+    """
+    # Karo başarısızsa get_terrain_raster üzerinden aynı karo tekrar denenmez, doğrudan pencereye düşülür
+    raster = get_tile_terrain(lat, lon) or _window_raster([lon - 0.005, lat - 0.005, lon + 0.005, lat + 0.005])
+    if raster is None:
+        return None
+    elevation = float(sample_bilinear(raster, "z", lon, lat))
+    if np.isnan(elevation):
+        elevation = float(sample_raster(raster, "z", lon, lat))
+    slope, aspect = float(sample_raster(raster, "slope", lon, lat)), float(sample_raster(raster, "aspect", lon, lat))
+    if np.isnan(elevation) or np.isnan(slope):
+        return None
+    return {"elevation": elevation, "slope": slope, "aspect": aspect}
+
+
+def table_terrain_mask(raster, corners, max_slope=None, exclude_north=False):
+    """
+    Masaların arazi uygunluğu: corners (N, 4, 2) lon/lat.
+    Köşeler ve merkezden biri max_slope'u aşarsa, veya (exclude_north) merkez hücre kuzeye bakıyorsa masa elenir.
+    Raster dışında kalan noktalar elemez.
+    Dönüş: (N,) bool, True = yerleştirilebilir
+    """
+    keep = np.ones(len(corners), dtype=bool)
+    if raster is None or not len(corners):
+        return keep
+
+    center = corners.mean(axis=1)
+    points = np.concatenate([corners, center[:, None, :]], axis=1)  # (N, 5, 2)
+    slopes = sample_raster(raster, "slope", points[..., 0], points[..., 1])
+
+    if max_slope is not None:
+        keep &= ~(np.nan_to_num(slopes, nan=0.0) > max_slope).any(axis=1)
+    if exclude_north:
+        aspect = sample_raster(raster, "aspect", center[:, 0], center[:, 1])
+        north = np.minimum(aspect, 360.0 - aspect) < NORTH_ASPECT_LIMIT
+        keep &= ~(north & (np.nan_to_num(slopes[:, 4], nan=0.0) >= MIN_ASPECT_SLOPE))
+    return keep
+
+
+# --- PARSEL ARAZİ İSTATİSTİKLERİ (ZONAL) ---
+def geometry_key(geometry):
+    """GeoJSON geometrisinin kararlı özeti (önbellek anahtarı)."""
+    return hashlib.md5(json.dumps(geometry, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _describe(values):
+    """Ortalama, min/max ve yüzdelikler (NaN'lar dışarıda)."""
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    pct = np.percentile(values, PERCENTILES)
+    out = {"min": float(values.min()), "max": float(values.max()), "mean": float(values.mean())}
+    out.update({f"p{p}": float(v) for p, v in zip(PERCENTILES, pct)})
+    return out
+
+
+def parcel_cell_mask(geometry, raster):
+    """
+    Parseli DEM ızgarasına rasterlaştırır: merkezi parsel içinde kalan hücreler (vektörel contains_xy).
+    Parsel hücreden küçükse en yakın hücre alınır. Dönüş: raster z boyutunda bool maske
+    """
+    geom = shape(geometry) if isinstance(geometry, dict) else geometry
+    shapely.prepare(geom)
+    X, Y = np.meshgrid(raster["x"], raster["y"])
+    mask = shapely.contains_xy(geom, X, Y)
+    if not mask.any():
+        point = geom.representative_point()
+        row = int(np.argmin(np.abs(raster["y"] - point.y)))
+        col = int(np.argmin(np.abs(raster["x"] - point.x)))
+        mask[row, col] = True
+    return mask
+
+
+def _parcel_stats(geometry):
+    geom = shape(geometry)
+    raster = get_terrain_raster(geom.bounds)
+    if raster is None:
+        return None
+    mask = parcel_cell_mask(geom, raster)
+    z = np.asarray(raster["z"], dtype=np.float64)[mask]
+    slope, aspect = raster["slope"][mask].astype(np.float64), raster["aspect"][mask].astype(np.float64)
+    n = len(slope)
+
+    class_idx = np.digitize(slope, [c[1] for c in SLOPE_CLASSES[:-1]])
+    class_counts = np.bincount(class_idx, minlength=len(SLOPE_CLASSES))
+    sloped = slope >= MIN_ASPECT_SLOPE  # Düz hücrelerin bakısı anlamsız
+    sector = ((aspect[sloped] + 22.5) // 45).astype(np.int64) % 8
+    sector_counts = np.bincount(sector, minlength=8)
+    z_valid = z[~np.isnan(z)]
+    z_counts, z_edges = np.histogram(z_valid, bins=ELEVATION_BINS) if len(z_valid) else (np.array([]), np.array([]))
+
+    return {
+        "cells": int(n),
+        "elevation": _describe(z),
+        "slope": _describe(slope),
+        "slope_classes": {label: float(c / n) for (_, _, label), c in zip(SLOPE_CLASSES, class_counts)},
+        "aspect_sectors": dict({name: float(c / n) for name, c in zip(ASPECT_NAMES, sector_counts)},
+                               **{"Düz": float((~sloped).sum() / n)}),
+        "elevation_histogram": {"edges": z_edges.tolist(), "counts": z_counts.tolist()},
+        "usable_fraction": float((slope <= USABLE_SLOPE).mean()),
+        "south_facing_fraction": float(((aspect >= 135) & (aspect <= 225) & sloped).mean()),
+    }
+
+
+def parcel_terrain_stats(geometry):
+    """
+    Parsel geneli arazi dağılımları: rakım/eğim özetleri ve yüzdelikleri, eğim sınıfı ve bakı yönü oranları,
+    rakım histogramı, kullanılabilir alan oranı (eğim <= USABLE_SLOPE). Oranlar hücre sayısına göredir (0-1).
+    geometry: GeoJSON geometrisi (dict). Sonuçlar geometri özetine göre önbelleklenir. Veri yoksa None.
+    """
+    key = geometry_key(geometry)
+    with _STATS_LOCK:
+        if key in _STATS_CACHE:
+            _STATS_CACHE.move_to_end(key)
+            return _STATS_CACHE[key]
+
+    stats = coalesce(("parcel_stats", key), lambda: _parcel_stats(geometry))
+    if stats is not None:
+        with _STATS_LOCK:
+            _STATS_CACHE[key] = stats
+            while len(_STATS_CACHE) > STATS_CACHE_SIZE:
+                _STATS_CACHE.popitem(last=False)
+    return stats